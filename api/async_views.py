@@ -0,0 +1,149 @@
+"""
+Async versions of the hot read and join/leave views, served instead of the
+ones in api.views when ``API_ASYNC_VIEWS`` is on (``SERVER_MODE=asgi``).
+
+They return exactly what their sync counterparts return. Under an ASGI
+server a request waiting on the database no longer holds a worker, only a
+coroutine.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import Http404, JsonResponse
+
+from .attendance import JOINED, LEFT, ajoin, aleave
+from .cache import cache_response, event_scope, user_events_scope
+from .conditional import (
+    aevent_attendees_validators, aone_event_validators, auser_events_validators, conditional,
+)
+from .models import Attendee, Event
+from .pagination import InvalidPage, apaginate, get_limit
+from .streaming import aiter_rows, stream_json_list, wants_stream
+from .views import (
+    ATTENDEE_ORDERING, EVENT_ORDERING, EVENT_ROW_FIELDS, attendance_error, event_data, event_row_data,
+)
+from .writebehind import aqueue_join, aqueue_leave
+
+
+def csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt wraps views in a sync function
+    # until Django 5.0, which would hide that these are coroutines.
+    view.csrf_exempt = True
+    return view
+
+
+async def _aget_or_404(model, **kwargs):
+    try:
+        return await model.objects.aget(**kwargs)
+    except model.DoesNotExist:
+        raise Http404('No %s matches the given query.' % model._meta.object_name)
+
+
+@csrf_exempt
+async def join_event(request, user_id, event_id):
+    if request.method == 'POST':
+        queued = settings.API_WRITE_BEHIND
+        outcome, username = await (aqueue_join if queued else ajoin)(user_id, event_id)
+
+        if outcome == JOINED:
+            return JsonResponse({
+                'data': {
+                    'user_id': user_id,
+                    'event_id': event_id,
+                    'username': username,
+                }
+            }, status=202 if queued else 201)
+        return attendance_error(outcome)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@csrf_exempt
+async def leave_event(request, user_id, event_id):
+    if request.method == 'POST':
+        queued = settings.API_WRITE_BEHIND
+        outcome = await (aqueue_leave if queued else aleave)(user_id, event_id)
+
+        if outcome == LEFT:
+            return JsonResponse({'message': 'User has left the event'}, status=202 if queued else 200)
+        return attendance_error(outcome)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@cache_response(event_scope)
+@conditional(aevent_attendees_validators)
+async def event_attendees(request, event_id):
+    if request.method == 'GET':
+        try:
+            event = await _aget_or_404(Event, id=event_id)
+            rows = Attendee.objects.filter(event=event).values_list('user_id', 'user__username')
+            if wants_stream(request):
+                rows = aiter_rows(rows.order_by(*ATTENDEE_ORDERING))
+                return stream_json_list('attendees', ({
+                    'user_id': user_id,
+                    'username': username
+                } async for user_id, username in rows))
+
+            try:
+                attendees, next_cursor = await apaginate(
+                    rows,
+                    ATTENDEE_ORDERING,
+                    request.GET.get('cursor'),
+                    get_limit(request),
+                    key=lambda row: [row[0]]
+                )
+            except InvalidPage as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+            attendees_list = [{
+                'user_id': user_id,
+                'username': username
+            } for user_id, username in attendees]
+
+            return JsonResponse({'attendees': attendees_list, 'next': next_cursor}, status=200)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@cache_response(user_events_scope)
+@conditional(auser_events_validators)
+async def get_user_events(request, user_id):
+    if request.method == 'GET':
+        try:
+            user = await _aget_or_404(User, id=user_id)
+            if wants_stream(request):
+                rows = aiter_rows(
+                    Event.objects.filter(owner=user).order_by(*EVENT_ORDERING).values_list(*EVENT_ROW_FIELDS)
+                )
+                return stream_json_list('events', (event_row_data(row, user.username) async for row in rows))
+
+            try:
+                events, next_cursor = await apaginate(
+                    Event.objects.filter(owner=user),
+                    EVENT_ORDERING,
+                    request.GET.get('cursor'),
+                    get_limit(request)
+                )
+            except InvalidPage as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+            events_list = [event_data(event, user.username) for event in events]
+
+            return JsonResponse({'events': events_list, 'next': next_cursor}, status=200)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+@cache_response(event_scope)
+@conditional(aone_event_validators)
+async def get_one_event(request, user_id, event_id):
+    if request.method == 'GET':
+        try:
+            user = await _aget_or_404(User, id=user_id)
+            event = await _aget_or_404(Event, id=event_id, owner=user)
+
+            return JsonResponse({'event': event_data(event, user.username)}, status=200)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
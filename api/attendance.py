@@ -0,0 +1,410 @@
+"""
+Write paths for event attendance.
+
+Every change to a set of attendee rows is followed, in the same transaction,
+by one UPDATE that moves ``Event.attendee_count`` by the number of rows that
+actually changed and bumps ``Event.last_modified``. The statements bypass
+model signals, so they invalidate cached responses themselves (the events',
+their owners' event lists and their concerts'), once per statement rather
+than once per attendee row.
+
+The attendee rows that changed also move the co-attendance counts of
+api.coattendance, in the same transaction, and are published to the live
+streams of their events (api.live) once it commits.
+
+Where the backend supports RETURNING (SQLite 3.35+, PostgreSQL) the rows that
+changed are read back from the write itself; otherwise they are looked up
+before the write.
+"""
+
+from collections import Counter
+from itertools import product
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .cache import concert_scope, event_scope, invalidate, user_events_scope
+from .coattendance import record_joins, record_leaves
+from .live import publish
+from .models import Attendee, Event
+
+USER_NOT_FOUND = 'user_not_found'
+EVENT_NOT_FOUND = 'event_not_found'
+JOINED = 'joined'
+ALREADY_ATTENDING = 'already_attending'
+LEFT = 'left'
+NOT_ATTENDING = 'not_attending'
+
+
+def _can_return():
+    # Every backend that can return columns from an INSERT can from UPDATE
+    # and DELETE as well.
+    return connection.features.can_return_columns_from_insert
+
+
+def _names():
+    qn = connection.ops.quote_name
+    return {
+        'attendee': qn(Attendee._meta.db_table),
+        'event': qn(Event._meta.db_table),
+        'user': qn(User._meta.db_table),
+        'id': qn('id'),
+        'event_id': qn(Attendee._meta.get_field('event').column),
+        'user_id': qn(Attendee._meta.get_field('user').column),
+        'username': qn(User._meta.get_field('username').column),
+        'owner_id': qn(Event._meta.get_field('owner').column),
+        'concert_id': qn(Event._meta.get_field('concert').column),
+        'attendee_count': qn(Event._meta.get_field('attendee_count').column),
+        'last_modified': qn(Event._meta.get_field('last_modified').column),
+    }
+
+
+def _placeholders(count):
+    return ', '.join(['%s'] * count)
+
+
+def apply_attendance_changes(deltas, joined=(), left=()):
+    """
+    Move ``attendee_count`` by ``deltas`` (``{event_id: change}``), bump
+    ``last_modified`` and invalidate the cached responses of those events, of
+    their owners' event lists and of their concerts. One UPDATE.
+
+    ``joined`` and ``left`` are the ``(user_id, event_id)`` pairs behind the
+    deltas, published with the new counts when the transaction commits.
+    """
+    if not deltas:
+        return
+    event_ids = list(deltas)
+    now = timezone.now()
+
+    if _can_return():
+        cases = ' '.join(['WHEN %s THEN %s'] * len(event_ids))
+        sql = (
+            'UPDATE {event} SET {attendee_count} = {attendee_count} + CASE {id} ' + cases + ' ELSE 0 END, '
+            '{last_modified} = %s WHERE {id} IN (' + _placeholders(len(event_ids)) + ') '
+            'RETURNING {owner_id}, {concert_id}, {id}, {attendee_count}'
+        ).format(**_names())
+        params = [value for event_id in event_ids for value in (event_id, deltas[event_id])]
+        params += [connection.ops.adapt_datetimefield_value(now)] + event_ids
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+    else:
+        change = Case(
+            *[When(id=event_id, then=Value(delta)) for event_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        queryset = Event.objects.filter(id__in=event_ids)
+        queryset.update(attendee_count=F('attendee_count') + change, last_modified=now)
+        rows = list(queryset.values_list('owner_id', 'concert_id', 'id', 'attendee_count'))
+
+    invalidate(
+        *[event_scope(event_id) for event_id in event_ids],
+        *[user_events_scope(owner_id) for owner_id in {row[0] for row in rows}],
+        *[concert_scope(concert_id) for concert_id in {row[1] for row in rows} if concert_id is not None]
+    )
+    counts = {row[2]: row[3] for row in rows}
+    transaction.on_commit(lambda: publish(counts, joined, left), robust=True)
+
+
+def _insert_pairs(pairs):
+    """
+    Insert ``(user_id, event_id)`` attendee rows, ignoring pairs that are
+    already attending, and return the set of pairs that were inserted.
+    """
+    if not pairs:
+        return set()
+    if not _can_return():
+        attending = _attending(pairs)
+        new = [pair for pair in pairs if pair not in attending]
+        Attendee.objects.bulk_create(
+            [Attendee(user_id=user_id, event_id=event_id) for user_id, event_id in new], ignore_conflicts=True
+        )
+        return set(new)
+
+    names = _names()
+    inserted = set()
+    batch_size = connection.ops.bulk_batch_size(['event', 'user'], pairs)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            sql = (
+                'INSERT INTO {attendee} ({user_id}, {event_id}) VALUES '
+                + ', '.join(['(%s, %s)'] * len(batch))
+                + ' ON CONFLICT ({event_id}, {user_id}) DO NOTHING RETURNING {user_id}, {event_id}'
+            ).format(**names)
+            cursor.execute(sql, [value for pair in batch for value in pair])
+            inserted.update(tuple(row) for row in cursor.fetchall())
+    return inserted
+
+
+def _delete_pairs(user_ids, event_ids):
+    """
+    Delete the attendee rows of every user in ``user_ids`` for every event in
+    ``event_ids`` and return the set of ``(user_id, event_id)`` pairs deleted.
+    """
+    if not user_ids or not event_ids:
+        return set()
+    user_ids, event_ids = list(user_ids), list(event_ids)
+    # A statement rather than QuerySet.delete(), which fetches the rows and
+    # sends post_delete for each because api.signals listens on Attendee
+    sql = (
+        'DELETE FROM {attendee} WHERE {user_id} IN (' + _placeholders(len(user_ids)) + ') '
+        'AND {event_id} IN (' + _placeholders(len(event_ids)) + ')'
+    ).format(**_names())
+    returning = _can_return()
+    if returning:
+        sql += ' RETURNING {user_id}, {event_id}'.format(**_names())
+    else:
+        attending = _attending(list(product(user_ids, event_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, user_ids + event_ids)
+        return {tuple(row) for row in cursor.fetchall()} if returning else attending
+
+
+def delete_event_attendees(event_id):
+    """
+    Delete every attendee row of ``event_id``, which is being deleted, with
+    one statement. The collector would fetch them and delete them 100 at a
+    time, because api.signals listens on Attendee; those receivers ignore
+    deletes cascaded from an event anyway.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {attendee} WHERE {event_id} = %s'.format(**_names()), [event_id])
+
+
+def _attending(pairs):
+    user_ids = {user_id for user_id, _ in pairs}
+    event_ids = {event_id for _, event_id in pairs}
+    return set(
+        Attendee.objects.filter(user_id__in=user_ids, event_id__in=event_ids).values_list('user_id', 'event_id')
+    ) & set(pairs)
+
+
+def _unique(ids):
+    return list(dict.fromkeys(ids))
+
+
+def _existing(user_ids, event_ids):
+    users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    events = set(Event.objects.filter(id__in=event_ids).values_list('id', flat=True))
+    return users, events
+
+
+def _outcome(user_id, event_id, users, events, changed, done, unchanged):
+    if user_id not in users:
+        return USER_NOT_FOUND
+    if event_id not in events:
+        return EVENT_NOT_FOUND
+    return done if (user_id, event_id) in changed else unchanged
+
+
+def join_many(user_ids, event_ids):
+    """
+    Have every user in ``user_ids`` join every event in ``event_ids`` and
+    return a ``(user_id, event_id, outcome)`` triple per pair.
+
+    One existence check per table, one INSERT that skips pairs already
+    attending and one UPDATE of the affected events, whatever the batch size.
+    """
+    user_ids, event_ids = _unique(user_ids), _unique(event_ids)
+    with transaction.atomic():
+        users, events = _existing(user_ids, event_ids)
+        pairs = [(user_id, event_id) for user_id, event_id in product(user_ids, event_ids)
+                 if user_id in users and event_id in events]
+        joined = _insert_pairs(pairs)
+        record_joins(joined)
+        apply_attendance_changes(Counter(event_id for _, event_id in joined), joined=joined)
+    return [
+        (user_id, event_id, _outcome(user_id, event_id, users, events, joined, JOINED, ALREADY_ATTENDING))
+        for user_id, event_id in product(user_ids, event_ids)
+    ]
+
+
+def leave_many(user_ids, event_ids):
+    """
+    Have every user in ``user_ids`` leave every event in ``event_ids`` and
+    return a ``(user_id, event_id, outcome)`` triple per pair.
+
+    One existence check per table, one DELETE and one UPDATE of the affected
+    events, whatever the batch size.
+    """
+    user_ids, event_ids = _unique(user_ids), _unique(event_ids)
+    with transaction.atomic():
+        users, events = _existing(user_ids, event_ids)
+        left = _delete_pairs(users, events)
+        record_leaves(left)
+        apply_attendance_changes(
+            {event_id: -count for event_id, count in Counter(e for _, e in left).items()}, left=left
+        )
+    return [
+        (user_id, event_id, _outcome(user_id, event_id, users, events, left, LEFT, NOT_ATTENDING))
+        for user_id, event_id in product(user_ids, event_ids)
+    ]
+
+
+def lookup(user_id, event_id):
+    """
+    Return ``(username, event exists, attending)`` for the pair, or None
+    when the user doesn't exist. One statement.
+    """
+    sql = (
+        'SELECT {username}, '
+        'EXISTS (SELECT 1 FROM {event} WHERE {event}.{id} = %s), '
+        'EXISTS (SELECT 1 FROM {attendee} WHERE {attendee}.{event_id} = %s AND {attendee}.{user_id} = %s) '
+        'FROM {user} WHERE {user}.{id} = %s'
+    ).format(**_names())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [event_id, event_id, user_id, user_id])
+        row = cursor.fetchone()
+    return row and (row[0], bool(row[1]), bool(row[2]))
+
+
+def write_pairs(joins, leaves):
+    """
+    Insert the ``(user_id, event_id)`` attendee rows of ``joins`` and delete
+    those of ``leaves``, no pair being in both, and return the
+    ``(joined, left)`` sets of pairs that changed. Joins of users or events
+    that no longer exist are dropped.
+
+    One existence check per table, then one transaction: a DELETE per event
+    left, one INSERT and one UPDATE of the affected events. The leaves are
+    applied first so each co-attendance update sees the rows it expects.
+    The check runs before the transaction because on SQLite a transaction
+    that reads first can't wait for the write lock: it fails with "database
+    is locked" when another connection wrote since its read. A join whose
+    user or event is deleted in between fails the whole call, and the next
+    call drops it.
+    """
+    users, events = _existing({user_id for user_id, _ in joins}, {event_id for _, event_id in joins})
+    with transaction.atomic():
+        leaving = {}
+        for user_id, event_id in leaves:
+            leaving.setdefault(event_id, []).append(user_id)
+        left = set()
+        for event_id, user_ids in leaving.items():
+            left |= _delete_pairs(user_ids, [event_id])
+        record_leaves(left)
+        joined = _insert_pairs([
+            (user_id, event_id) for user_id, event_id in joins if user_id in users and event_id in events
+        ])
+        record_joins(joined)
+        deltas = Counter(event_id for _, event_id in joined)
+        deltas.subtract(event_id for _, event_id in left)
+        apply_attendance_changes(deltas, joined, left)
+    return joined, left
+
+
+def _insert_attendee(user_id, event_id):
+    """
+    Insert the attendee row if both the user and the event exist and the
+    pair isn't attending yet, all in one statement. Returns the username when
+    a row was inserted, ``False`` when it wasn't and ``None`` when a row was
+    inserted but the backend can't return the username with it.
+    """
+    sql = (
+        'INSERT INTO {attendee} ({event_id}, {user_id}) '
+        'SELECT {event}.{id}, {user}.{id} FROM {event}, {user} '
+        'WHERE {event}.{id} = %s AND {user}.{id} = %s '
+        'ON CONFLICT ({event_id}, {user_id}) DO NOTHING'
+    )
+    returning = _can_return()
+    if returning:
+        sql += ' RETURNING (SELECT {username} FROM {user} WHERE {user}.{id} = {attendee}.{user_id})'
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(**_names()), [event_id, user_id])
+        if returning:
+            row = cursor.fetchone()
+            return row[0] if row else False
+        return None if cursor.rowcount == 1 else False
+
+
+def _miss(user_id, event_id, outcome):
+    # Only reached when the write matched nothing, so the happy path never
+    # pays for these lookups.
+    if not User.objects.filter(id=user_id).exists():
+        return USER_NOT_FOUND
+    if not Event.objects.filter(id=event_id).exists():
+        return EVENT_NOT_FOUND
+    return outcome
+
+
+async def _amiss(user_id, event_id, outcome):
+    if not await User.objects.filter(id=user_id).aexists():
+        return USER_NOT_FOUND
+    if not await Event.objects.filter(id=event_id).aexists():
+        return EVENT_NOT_FOUND
+    return outcome
+
+
+def _username(user_id):
+    return User.objects.filter(id=user_id).values_list('username', flat=True)
+
+
+def _join(user_id, event_id):
+    with transaction.atomic():
+        username = _insert_attendee(user_id, event_id)
+        if username is not False:
+            record_joins([(user_id, event_id)])
+            apply_attendance_changes({event_id: 1}, joined=[(user_id, event_id)])
+    return username
+
+
+def _leave(user_id, event_id):
+    with transaction.atomic():
+        left = _delete_pairs([user_id], [event_id])
+        if left:
+            record_leaves(left)
+            apply_attendance_changes({event_id: -1}, left=left)
+    return bool(left)
+
+
+def join(user_id, event_id):
+    """
+    Add ``user_id`` to ``event_id``'s attendees and return
+    ``(outcome, username)``, ``username`` being set only when the user joined.
+
+    The insert is a single ``INSERT ... SELECT ... ON CONFLICT DO NOTHING``,
+    so concurrent joins of the same pair can't raise an IntegrityError; the
+    losers just see that nothing was inserted.
+    """
+    username = _join(user_id, event_id)
+    if username is False:
+        return _miss(user_id, event_id, ALREADY_ATTENDING), None
+    if username is None:
+        username = _username(user_id).get()
+    return JOINED, username
+
+
+def leave(user_id, event_id):
+    """
+    Remove ``user_id`` from ``event_id``'s attendees with a single DELETE and
+    return the outcome.
+    """
+    if not _leave(user_id, event_id):
+        return _miss(user_id, event_id, NOT_ATTENDING)
+    return LEFT
+
+
+# Async versions for api.async_views. The async ORM can't open transactions,
+# so the write and its count update run in one sync_to_async call; the lookups
+# around it use the async ORM.
+
+async def ajoin(user_id, event_id):
+    username = await sync_to_async(_join)(user_id, event_id)
+    if username is False:
+        return await _amiss(user_id, event_id, ALREADY_ATTENDING), None
+    if username is None:
+        username = await _username(user_id).aget()
+    return JOINED, username
+
+
+async def aleave(user_id, event_id):
+    if not await sync_to_async(_leave)(user_id, event_id):
+        return await _amiss(user_id, event_id, NOT_ATTENDING)
+    return LEFT
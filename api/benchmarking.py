@@ -0,0 +1,162 @@
+"""
+Helpers for the benchmark management commands.
+
+Benchmarks run against a throwaway copy of the schema (the test database)
+rather than the configured one, and report latency percentiles the same way
+so their numbers can be compared with each other.
+"""
+
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+from concertmate_be.database import database_url
+
+
+def percentile(ordered, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Summarize request ``latencies`` (in seconds) taken over ``elapsed``
+    seconds. Latencies are reported in milliseconds.
+    """
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': len(ordered) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+        'max_ms': (ordered[-1] if ordered else 0.0) * 1000,
+    }
+
+
+@contextmanager
+def isolated_database():
+    """
+    Create and migrate the test database, point the default connection at it
+    and yield its name. It's destroyed, and the connection restored, on exit.
+    """
+    old_name = connection.settings_dict['NAME']
+    name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield name
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve(server_mode, workers, port, **environ):
+    """
+    Run gunicorn in ``server_mode`` on ``port``, against the database the
+    default connection points at, until the block exits. ``environ`` is added
+    to the servers' environment.
+    """
+    env = dict(
+        os.environ,
+        SERVER_MODE=server_mode,
+        DATABASE_URL=database_url(connection.settings_dict),
+        **environ
+    )
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', '127.0.0.1:%s' % port,
+            '--workers', str(workers),
+            '--log-level', 'warning',
+        ],
+        cwd=settings.BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def fetch(host, port, method, path):
+    """
+    Send one request on a fresh connection and return its status code.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write((
+            '%s %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\nContent-Length: 0\r\n\r\n' % (method, path, host)
+        ).encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    return int(status_line.split()[1])
+
+
+def wait_until_ready(host, port, path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if asyncio.run(fetch(host, port, 'GET', path)) < 500:
+                return
+        except (OSError, IndexError, ValueError):
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError('Server on port %s did not come up' % port)
+        time.sleep(0.2)
+
+
+def run_load(host, port, next_request, concurrency, duration):
+    """
+    Keep ``concurrency`` requests in flight for ``duration`` seconds and
+    return their ``summarize()``. ``next_request()`` returns the
+    ``(method, path)`` of each request; responses of 500 and above and
+    connection failures count as errors.
+    """
+    return asyncio.run(_load(host, port, next_request, concurrency, duration))
+
+
+async def _load(host, port, next_request, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, path = next_request()
+            start = time.perf_counter()
+            try:
+                status = await fetch(host, port, method, path)
+            except (OSError, IndexError, ValueError):
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status is None or status >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return summarize(latencies, errors, time.perf_counter() - start)
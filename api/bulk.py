@@ -0,0 +1,215 @@
+"""
+Bulk event import.
+
+Items are validated in Python up front so that the database only sees the
+rows that will be inserted, then written with multi-row INSERTs in batches
+inside a single transaction.
+"""
+
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalidate, user_events_scope
+from .catalog import link_imported
+from .geo import clean_coordinates, locate
+from .models import Event
+
+EVENT_FIELDS = (
+    'venue_name', 'event_name', 'date_time', 'artist',
+    'location', 'spotify_artist_id', 'ticketmaster_event_id',
+)
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl')
+
+ON_CONFLICT_CHOICES = ('insert', 'skip')
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+def parse_items(request):
+    """
+    Read the events of a bulk request, either a JSON array or one JSON object
+    per line when the request is sent as NDJSON.
+    """
+    limit = settings.BULK_IMPORT_MAX_ITEMS
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        items = []
+        for number, line in enumerate(request, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise BulkImportError('Invalid JSON on line %s' % number)
+            if len(items) > limit:
+                raise BulkImportError('Too many events, the limit is %s' % limit)
+        return items
+
+    try:
+        items = json.loads(request.body)
+    except json.JSONDecodeError:
+        raise BulkImportError('Invalid JSON')
+    if not isinstance(items, list):
+        raise BulkImportError('Expected a JSON array of events')
+    if len(items) > limit:
+        raise BulkImportError('Too many events, the limit is %s' % limit)
+    return items
+
+
+def parse_options(request):
+    on_conflict = request.GET.get('on_conflict', 'insert')
+    if on_conflict not in ON_CONFLICT_CHOICES:
+        raise BulkImportError('on_conflict must be one of: %s' % ', '.join(ON_CONFLICT_CHOICES))
+    try:
+        batch_size = int(request.GET.get('batch_size', settings.BULK_IMPORT_BATCH_SIZE))
+    except ValueError:
+        raise BulkImportError('batch_size must be an integer')
+    if batch_size < 1:
+        raise BulkImportError('batch_size must be a positive integer')
+    return {'skip_conflicts': on_conflict == 'skip', 'batch_size': batch_size}
+
+
+def clean_event(item):
+    """
+    Return ``(values, errors)`` for one imported event. ``values`` maps
+    field names to Python values; ``errors`` maps field names to messages.
+    """
+    if not isinstance(item, dict):
+        return None, {'event': 'Expected a JSON object'}
+
+    values, errors = {}, {}
+    for name in EVENT_FIELDS:
+        value = item.get(name)
+        if value is None or value == '':
+            errors[name] = 'This field is required'
+        elif not isinstance(value, str):
+            errors[name] = 'Expected a string'
+        elif name == 'date_time':
+            try:
+                parsed = parse_datetime(value)
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                errors[name] = 'Invalid date_time'
+            else:
+                values[name] = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+        elif len(value) > Event._meta.get_field(name).max_length:
+            errors[name] = 'Ensure this value has at most %s characters' % Event._meta.get_field(name).max_length
+        else:
+            values[name] = value
+    try:
+        values['latitude'], values['longitude'] = clean_coordinates(item.get('latitude'), item.get('longitude'))
+    except ValueError as e:
+        errors['latitude'] = str(e)
+    return (None, errors) if errors else (values, None)
+
+
+def import_events(owner, items, batch_size, skip_conflicts=False):
+    """
+    Insert ``items`` as events owned by ``owner`` and return one result per
+    item, in order.
+
+    With ``skip_conflicts`` an item is skipped when the owner already has an
+    event with its ``ticketmaster_event_id``, or an earlier item had it.
+    """
+    results = [None] * len(items)
+    cleaned = []
+    for index, item in enumerate(items):
+        values, errors = clean_event(item)
+        if errors:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': errors}
+        else:
+            cleaned.append((index, values))
+
+    with transaction.atomic():
+        seen = set()
+        if skip_conflicts:
+            seen.update(Event.objects.filter(owner=owner).values_list('ticketmaster_event_id', flat=True))
+
+        indexes, created = [], []
+        for index, values in cleaned:
+            ticketmaster_event_id = values['ticketmaster_event_id']
+            if skip_conflicts and ticketmaster_event_id in seen:
+                results[index] = {
+                    'index': index,
+                    'status': 'skipped',
+                    'ticketmaster_event_id': ticketmaster_event_id,
+                }
+                continue
+            seen.add(ticketmaster_event_id)
+            indexes.append(index)
+            created.append(values)
+
+        if created:
+            ids = insert_events(owner, created, batch_size)
+            # Raw inserts don't send post_save
+            invalidate(user_events_scope(owner.id))
+            for index, event_id in zip(indexes, ids):
+                results[index] = {'index': index, 'status': 'created', 'event_id': event_id}
+    return results
+
+
+def insert_events(owner, rows, batch_size):
+    """
+    Insert cleaned event ``rows`` and return their ids in order (``None``s
+    when the backend can't return ids from a multi-row insert).
+
+    Equivalent to ``bulk_create`` without building a model instance and
+    compiling every field value through the ORM per row, which dominates the
+    cost of large imports. The events are then linked to their concerts
+    with two statements, see catalog.link_imported().
+    """
+    ops = connection.ops
+    fields = [
+        Event._meta.get_field(name)
+        for name in EVENT_FIELDS + ('last_modified', 'attendee_count', 'owner', 'latitude', 'longitude', 'geohash')
+    ]
+    columns = ', '.join(ops.quote_name(field.column) for field in fields)
+    placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+    returning = connection.features.can_return_rows_from_bulk_insert
+    batch_size = max(1, min(batch_size, ops.bulk_batch_size(fields, rows)))
+    sql = 'INSERT INTO %s (%s) VALUES ' % (ops.quote_name(Event._meta.db_table), columns)
+
+    now = ops.adapt_datetimefield_value(timezone.now())
+    # Raw inserts don't send pre_save, which sets these otherwise. An import
+    # repeats a few venues and cities, each is looked up and encoded once.
+    located = {}
+    for row in rows:
+        key = (row['latitude'], row['longitude'], row['location'])
+        if key not in located:
+            located[key] = locate(*key)
+    params = [
+        (
+            row['venue_name'], row['event_name'], ops.adapt_datetimefield_value(row['date_time']),
+            row['artist'], row['location'], row['spotify_artist_id'], row['ticketmaster_event_id'],
+            now, 0, owner.pk, *located[row['latitude'], row['longitude'], row['location']],
+        )
+        for row in rows
+    ]
+
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(params), batch_size):
+            batch = params[start:start + batch_size]
+            statement = sql + ', '.join([placeholders] * len(batch))
+            if returning:
+                statement += ' RETURNING %s' % ops.quote_name(Event._meta.pk.column)
+            cursor.execute(statement, [value for row in batch for value in row])
+            if returning:
+                ids.extend(row[0] for row in cursor.fetchall())
+            else:
+                ids.extend([None] * len(batch))
+    if returning:
+        link_imported(owner.pk, min(ids), max(ids))
+    else:
+        # Every unlinked event of the owner, which includes these
+        link_imported(owner.pk, 0, Event.objects.filter(owner=owner).aggregate(last=Max('id'))['last'])
+    return ids
@@ -0,0 +1,176 @@
+"""
+Response cache for the event read endpoints.
+
+Cached bodies are keyed on the request path plus a version token for each
+resource the response depends on (one event, or one owner's event list).
+Invalidating a resource replaces its token, which orphans every cached page,
+limit and cursor variant of it at once; the cache backend's LRU culling
+clears the orphans out later.
+"""
+
+import hashlib
+import threading
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .streaming import wants_stream
+
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def event_scope(event_id, **kwargs):
+    return 'event:%s' % event_id
+
+
+def user_events_scope(user_id, **kwargs):
+    return 'user-events:%s' % user_id
+
+
+def concert_scope(concert_id, **kwargs):
+    return 'concert:%s' % concert_id
+
+
+def _version_key(scope):
+    return 'api:version:%s' % scope
+
+
+def _new_versions(keys):
+    return {key: uuid.uuid4().hex for key in keys}
+
+
+def _versions(cache, scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = _new_versions(key for key in keys if key not in versions)
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*scopes):
+    """
+    Drop every cached response that depends on ``scopes``.
+
+    Inside a transaction the versions are replaced twice: right away, for
+    readers on the same connection, and again on commit so that a response
+    built from pre-commit data by another connection can't outlive the write.
+    """
+    keys = [_version_key(scope) for scope in scopes]
+
+    def bump():
+        get_cache().set_many(_new_versions(keys), None)
+
+    bump()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / lookups if lookups else 0.0,
+    }
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
+
+
+def _lookup(request, kwargs, scope_funcs):
+    """
+    Return ``(key, response)``, ``response`` being the cached response for
+    ``request`` or ``None`` on a miss.
+    """
+    cache = get_cache()
+    versions = _versions(cache, [scope(**kwargs) for scope in scope_funcs])
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    key = 'api:response:%s:%s' % (path, ':'.join(versions))
+
+    cached = cache.get(key)
+    if cached is None:
+        _record('misses')
+        return key, None
+
+    _record('hits')
+    content, content_type, headers = cached
+    response = HttpResponse(content, content_type=content_type)
+    for name, value in headers.items():
+        response[name] = value
+    # A cached entry is current by construction, so its validators can
+    # answer conditional requests without a query.
+    return key, get_conditional_response(
+        request,
+        etag=headers.get('ETag'),
+        last_modified=parse_http_date_safe(headers.get('Last-Modified')),
+        response=response,
+    )
+
+
+def _store(key, response):
+    if response.status_code == 200 and not response.streaming:
+        headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+        get_cache().set(key, (response.content, response['Content-Type'], headers), settings.API_CACHE_TIMEOUT)
+
+
+def cache_response(*scope_funcs):
+    """
+    Cache successful GET responses of a view, sync or async. Streamed
+    responses are passed through untouched.
+
+    Each of ``scope_funcs`` is called with the view's URL kwargs and names a
+    resource the response depends on.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method != 'GET' or wants_stream(request):
+                    return await view(request, *args, **kwargs)
+
+                # One thread hop for the whole lookup rather than one per
+                # cache call, the cache API is synchronous underneath.
+                key, response = await sync_to_async(_lookup)(request, kwargs, scope_funcs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    await sync_to_async(_store)(key, response)
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or wants_stream(request):
+                return view(request, *args, **kwargs)
+
+            key, response = _lookup(request, kwargs, scope_funcs)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                _store(key, response)
+            return response
+        return wrapper
+    return decorator
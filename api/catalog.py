@@ -0,0 +1,133 @@
+"""
+The concert catalog.
+
+Every user who saves a show gets their own Event, and every Event of one
+show links to the same Concert, the one with its ticketmaster_event_id. A
+concert is created from the first event saved for it, later copies don't
+change it. Attendance across all the copies of a show is read through the
+concert: ``Attendee.event__concert`` is one join on the event's concert_id
+index.
+
+Linking only sets an event's concert_id. Each event keeps the venue, name
+and date its owner gave it; the shared record of the show is the concert's,
+read through GET api/concerts/<id>.
+"""
+
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import Concert, Event
+
+CONCERT_FIELDS = (
+    'ticketmaster_event_id', 'venue_name', 'event_name', 'date_time',
+    'artist', 'location', 'spotify_artist_id',
+)
+
+
+def concert_for(event):
+    """
+    Return the id of ``event``'s concert, created from ``event`` if it's
+    the first of its show, or None when it has no ticketmaster_event_id.
+    """
+    if not event.ticketmaster_event_id:
+        return None
+    # Converted first, so an event that can't be saved (an invalid
+    # date_time) fails whether or not its show is known
+    defaults = {
+        name: Concert._meta.get_field(name).to_python(getattr(event, name)) for name in CONCERT_FIELDS[1:]
+    }
+    concert, _ = Concert.objects.get_or_create(ticketmaster_event_id=event.ticketmaster_event_id, defaults=defaults)
+    return concert.id
+
+
+def link_imported(owner_id, first_id, last_id):
+    """
+    Link ``owner_id``'s events with ids from ``first_id`` to ``last_id``
+    that have no concert, creating the missing concerts from the earliest
+    of each show. Two statements however many events were imported: bulk
+    imports insert rows directly and send no pre_save.
+    """
+    qn = connection.ops.quote_name
+    event, concert = Event._meta, Concert._meta
+    sql = (
+        'INSERT INTO {concert} ({columns}) SELECT {event_columns} FROM {event} WHERE {id} IN ('
+        'SELECT MIN({id}) FROM {event} WHERE {owner} = %s AND {id} >= %s AND {id} <= %s '
+        'AND {concert_id} IS NULL AND {tm} <> %s GROUP BY {tm}'
+        ') ON CONFLICT ({concert_tm}) DO NOTHING'
+    ).format(
+        concert=qn(concert.db_table),
+        columns=', '.join(qn(concert.get_field(name).column) for name in CONCERT_FIELDS),
+        event_columns=', '.join(qn(event.get_field(name).column) for name in CONCERT_FIELDS),
+        event=qn(event.db_table),
+        id=qn(event.pk.column),
+        owner=qn(event.get_field('owner').column),
+        concert_id=qn(event.get_field('concert').column),
+        tm=qn(event.get_field('ticketmaster_event_id').column),
+        concert_tm=qn(concert.get_field('ticketmaster_event_id').column),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [owner_id, first_id, last_id, ''])
+    return Event.objects.filter(
+        owner_id=owner_id, id__gte=first_id, id__lte=last_id, concert__isnull=True,
+    ).exclude(ticketmaster_event_id='').update(concert=Subquery(
+        Concert.objects.filter(ticketmaster_event_id=OuterRef('ticketmaster_event_id')).values('id')[:1]
+    ))
+
+
+def _insert_concerts(event_model, concert_model):
+    """
+    Return the INSERT ... SELECT creating the concerts of every show in a
+    ``(after, up to)`` range of ticketmaster_event_ids from the earliest
+    event of each, skipping those that exist. No model instance is built,
+    which is most of what bulk_create() would spend on a large table.
+    """
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(concert_model._meta.get_field(name).column) for name in CONCERT_FIELDS)
+    event_columns = ', '.join(qn(event_model._meta.get_field(name).column) for name in CONCERT_FIELDS)
+    event_table = qn(event_model._meta.db_table)
+    ticketmaster_event_id = qn(event_model._meta.get_field('ticketmaster_event_id').column)
+    return (
+        'INSERT INTO {concert} ({columns}) SELECT {event_columns} FROM {event} WHERE {id} IN ('
+        'SELECT MIN({id}) FROM {event} WHERE {tm} > %s AND {tm} <= %s GROUP BY {tm}'
+        ') ON CONFLICT ({concert_tm}) DO NOTHING'
+    ).format(
+        concert=qn(concert_model._meta.db_table),
+        columns=columns,
+        event_columns=event_columns,
+        event=event_table,
+        id=qn(event_model._meta.pk.column),
+        tm=ticketmaster_event_id,
+        concert_tm=qn(concert_model._meta.get_field('ticketmaster_event_id').column),
+    )
+
+
+def link_events(events, concert_model=Concert, batch_size=1000):
+    """
+    Link the events of queryset ``events`` that have no concert to the one
+    of their show, creating the missing concerts from the earliest event of
+    each. Return how many events were linked.
+
+    Works through ``batch_size`` shows at a time, one transaction each, so
+    a large table isn't locked for the whole run. Takes the models as
+    arguments so migrations can pass their historical ones.
+    """
+    insert = _insert_concerts(events.model, concert_model)
+    linked, last = 0, ''
+    while True:
+        # Walks the ticketmaster_event_id index, starting after '' skips
+        # the events that have none
+        keys = list(
+            events.filter(ticketmaster_event_id__gt=last).order_by('ticketmaster_event_id')
+            .values_list('ticketmaster_event_id', flat=True).distinct()[:batch_size]
+        )
+        if not keys:
+            return linked
+        shows = {'ticketmaster_event_id__gt': last, 'ticketmaster_event_id__lte': keys[-1]}
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(insert, [last, keys[-1]])
+            linked += events.filter(concert__isnull=True, **shows).update(concert=Subquery(
+                concert_model._default_manager.filter(ticketmaster_event_id=OuterRef('ticketmaster_event_id'))
+                .values('id')[:1]
+            ))
+        last = keys[-1]
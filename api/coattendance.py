@@ -0,0 +1,305 @@
+"""
+Co-attendance: how many users attend both of two events.
+
+``CoAttendance`` materializes the pair counts that would otherwise take a
+self-join of the attendee table per request. Every write that adds or
+removes attendee rows moves the counts of the pairs those rows are part of,
+in the same transaction, with one UPSERT that finds the users' other
+events itself. Related events and recommendations then read their top results from
+coattendance_top_idx.
+
+rebuild() recomputes the whole table inside the database, a range of
+events at a time, for data written around the API (seed_load, raw SQL).
+"""
+
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Attendee, CoAttendance, Event
+
+
+def _names():
+    qn = connection.ops.quote_name
+    return {
+        'table': qn(CoAttendance._meta.db_table),
+        'event_id': qn(CoAttendance._meta.get_field('event').column),
+        'other_id': qn(CoAttendance._meta.get_field('other').column),
+        'shared_count': qn(CoAttendance._meta.get_field('shared_count').column),
+        'attendee': qn(Attendee._meta.db_table),
+        'attendee_event_id': qn(Attendee._meta.get_field('event').column),
+        'attendee_user_id': qn(Attendee._meta.get_field('user').column),
+    }
+
+
+# The changed attendee rows are a VALUES list ("changed"). Joined rows are
+# already in the attendee table: each one pairs with all of its user's other
+# events, in both directions, except that two new events of the same user
+# are counted once from each end. Left rows are gone from it: each one
+# unpairs from its user's remaining events and from the user's other left
+# events. The deltas of every pair are summed before the UPSERT, which
+# can't update a row twice in one statement on PostgreSQL.
+CHANGED = 'WITH changed (user_id, event_id) AS (VALUES {values}) '
+
+UPSERT = (
+    'INSERT INTO {table} ({event_id}, {other_id}, {shared_count}) '
+    'SELECT pair_event, pair_other, SUM(delta) FROM ({deltas}) deltas WHERE true '
+    'GROUP BY pair_event, pair_other '
+    'ON CONFLICT ({event_id}, {other_id}) DO UPDATE '
+    'SET {shared_count} = {table}.{shared_count} + excluded.{shared_count}'
+)
+
+JOINED = (
+    'SELECT c.event_id AS pair_event, a.{attendee_event_id} AS pair_other, 1 AS delta '
+    'FROM changed c JOIN {attendee} a ON a.{attendee_user_id} = c.user_id AND a.{attendee_event_id} <> c.event_id '
+    'UNION ALL '
+    'SELECT a.{attendee_event_id}, c.event_id, 1 '
+    'FROM changed c JOIN {attendee} a ON a.{attendee_user_id} = c.user_id AND a.{attendee_event_id} <> c.event_id '
+    'WHERE NOT EXISTS ('
+    'SELECT 1 FROM changed n WHERE n.user_id = a.{attendee_user_id} AND n.event_id = a.{attendee_event_id})'
+)
+
+LEFT = (
+    'SELECT c.event_id AS pair_event, a.{attendee_event_id} AS pair_other, -1 AS delta '
+    'FROM changed c JOIN {attendee} a ON a.{attendee_user_id} = c.user_id '
+    'UNION ALL '
+    'SELECT a.{attendee_event_id}, c.event_id, -1 FROM changed c JOIN {attendee} a ON a.{attendee_user_id} = c.user_id '
+    'UNION ALL '
+    'SELECT c.event_id, n.event_id, -1 FROM changed c JOIN changed n ON n.user_id = c.user_id AND n.event_id <> c.event_id'
+)
+
+# The pairs a leave emptied are in the ranges of coattendance_top_idx of the
+# left events and of their users' remaining events
+PRUNE = (
+    'DELETE FROM {table} WHERE {shared_count} <= 0 AND {event_id} IN ('
+    'SELECT event_id FROM changed UNION '
+    'SELECT a.{attendee_event_id} FROM {attendee} a JOIN changed c ON a.{attendee_user_id} = c.user_id)'
+)
+
+
+def _user_batches(pairs):
+    """
+    Split ``(user_id, event_id)`` pairs into batches that fit in one
+    statement, never splitting one user's pairs.
+    """
+    by_user = _by_user(pairs)
+    limit = max(1, connection.ops.bulk_batch_size(['user', 'event'], list(pairs)))
+    batch = []
+    for user_id, event_ids in by_user.items():
+        if batch and len(batch) + len(event_ids) > limit:
+            yield batch
+            batch = []
+        batch.extend((user_id, event_id) for event_id in event_ids)
+    if batch:
+        yield batch
+
+
+def _execute(statement, pairs):
+    names = _names()
+    with connection.cursor() as cursor:
+        for batch in _user_batches(pairs):
+            values = ', '.join(['(%s, %s)'] * len(batch))
+            cursor.execute(
+                CHANGED.format(values=values) + statement.format(**names),
+                [value for pair in batch for value in pair],
+            )
+
+
+def _can_upsert():
+    return connection.features.supports_update_conflicts_with_target
+
+
+def _apply(deltas):
+    """
+    Add ``deltas`` (``{(event_id, other_id): change}``) to the pair counts
+    and drop the pairs left with no shared attendee, without UPSERT.
+    """
+    deltas = {pair: delta for pair, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    existing = CoAttendance.objects.filter(
+        event_id__in={event_id for event_id, _ in deltas}, other_id__in={other_id for _, other_id in deltas},
+    )
+    counts = {(row.event_id, row.other_id): row for row in existing}
+    for (event_id, other_id), delta in deltas.items():
+        row = counts.get((event_id, other_id))
+        if row is None:
+            CoAttendance.objects.create(event_id=event_id, other_id=other_id, shared_count=delta)
+        else:
+            row.shared_count += delta
+            row.save(update_fields=['shared_count'])
+    event_ids = list({event_id for event_id, _ in deltas})
+    sql = (
+        'DELETE FROM {table} WHERE {shared_count} <= 0 AND {event_id} IN (' + ', '.join(['%s'] * len(event_ids)) + ')'
+    ).format(**_names())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, event_ids)
+
+
+def _events_by_user(user_ids):
+    events = defaultdict(set)
+    for user_id, event_id in Attendee.objects.filter(user_id__in=user_ids).values_list('user_id', 'event_id'):
+        events[user_id].add(event_id)
+    return events
+
+
+def _by_user(pairs):
+    changed = defaultdict(set)
+    for user_id, event_id in pairs:
+        changed[user_id].add(event_id)
+    return changed
+
+
+def record_joins(pairs):
+    """
+    Count the ``(user_id, event_id)`` attendee rows just inserted in the
+    pairs they form with each other and with the users' other events.
+    """
+    if not pairs:
+        return
+    if _can_upsert():
+        _execute(UPSERT.replace('{deltas}', JOINED), pairs)
+        return
+
+    joined = _by_user(pairs)
+    attending = _events_by_user(list(joined))
+    deltas = Counter()
+    for user_id, new in joined.items():
+        for event_id in new:
+            for other_id in attending[user_id]:
+                if other_id == event_id:
+                    continue
+                deltas[event_id, other_id] += 1
+                if other_id not in new:
+                    deltas[other_id, event_id] += 1
+    _apply(deltas)
+
+
+def record_leaves(pairs):
+    """
+    Uncount the ``(user_id, event_id)`` attendee rows just deleted, the
+    opposite of record_joins().
+    """
+    if not pairs:
+        return
+    if _can_upsert():
+        _execute(UPSERT.replace('{deltas}', LEFT), pairs)
+        _execute(PRUNE, pairs)
+        return
+
+    left = _by_user(pairs)
+    attending = _events_by_user(list(left))
+    deltas = Counter()
+    for user_id, removed in left.items():
+        for event_id in removed:
+            for other_id in attending[user_id]:
+                deltas[event_id, other_id] -= 1
+                deltas[other_id, event_id] -= 1
+            for other_id in removed:
+                if other_id != event_id:
+                    deltas[event_id, other_id] -= 1
+    _apply(deltas)
+
+
+def forget_event(event_id):
+    """
+    Delete the rows pairing other events with ``event_id``, which is being
+    deleted. Its own rows go with it through the foreign key.
+    """
+    sql = (
+        'DELETE FROM {table} WHERE {other_id} = %s AND {event_id} IN ('
+        'SELECT {other_id} FROM {table} WHERE {event_id} = %s)'
+    ).format(**_names())
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [event_id, event_id])
+
+
+def related_events(event_id, limit):
+    """
+    Return ``(event_id, shared_count)`` of the ``limit`` events sharing the
+    most attendees with ``event_id``, most first.
+    """
+    return list(
+        CoAttendance.objects.filter(event_id=event_id)
+        .order_by('-shared_count', 'other_id')
+        .values_list('other_id', 'shared_count')[:limit]
+    )
+
+
+def _top_pairs(event_ids, limit):
+    """
+    ``(other_id, shared_count)`` of the ``limit`` best pairs of each of
+    ``event_ids``, one index seek each. Each branch has its own LIMIT, which
+    Django can't compile for a compound statement on SQLite.
+    """
+    branch = (
+        'SELECT * FROM (SELECT {other_id}, {shared_count} FROM {table} WHERE {event_id} = %s '
+        'ORDER BY {shared_count} DESC LIMIT %s) {alias}'
+    )
+    sql = ' UNION ALL '.join(branch.format(alias='t%s' % i, **_names()) for i in range(len(event_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for event_id in event_ids for value in (event_id, limit)])
+        return cursor.fetchall()
+
+
+def recommended_events(user_id, start, limit):
+    """
+    Return ``(event_id, score)`` of the ``limit`` events from ``start`` on
+    that share the most attendees with the events ``user_id`` attends,
+    leaving out those the user attends or owns. An event's score is the sum
+    of what it shares with each of them.
+
+    Only the user's latest API_RECOMMEND_SEED_EVENTS attended events count,
+    and of each only the API_RECOMMEND_CANDIDATES events it shares the most
+    attendees with, so the cost doesn't grow with how popular they are.
+    """
+    attending = list(Attendee.objects.filter(user_id=user_id).order_by('-id').values_list('event_id', flat=True))
+    seeds = attending[:settings.API_RECOMMEND_SEED_EVENTS]
+    if not seeds:
+        return []
+    scores = Counter()
+    for other_id, shared_count in _top_pairs(seeds, settings.API_RECOMMEND_CANDIDATES):
+        scores[other_id] += shared_count
+    for event_id in attending:
+        scores.pop(event_id, None)
+    allowed = set(
+        Event.objects.filter(id__in=list(scores), date_time__gte=start)
+        .exclude(owner_id=user_id).values_list('id', flat=True)
+    )
+    return heapq.nsmallest(
+        limit, ((event_id, score) for event_id, score in scores.items() if event_id in allowed),
+        key=lambda item: (-item[1], item[0]),
+    )
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute every pair count from the attendee table and return how many
+    pairs there are. One transaction; each statement aggregates the pairs of
+    ``batch_size`` events in the database, in index order.
+    """
+    names = _names()
+    sql = (
+        'INSERT INTO {table} ({event_id}, {other_id}, {shared_count}) '
+        'SELECT a.{attendee_event_id}, b.{attendee_event_id}, COUNT(*) '
+        'FROM {attendee} a JOIN {attendee} b '
+        'ON b.{attendee_user_id} = a.{attendee_user_id} AND b.{attendee_event_id} <> a.{attendee_event_id} '
+        'WHERE a.{attendee_event_id} > %s AND a.{attendee_event_id} <= %s '
+        'GROUP BY a.{attendee_event_id}, b.{attendee_event_id}'
+    ).format(**names)
+    pairs, last = 0, 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {table}'.format(**names))
+            while True:
+                event_ids = list(
+                    Attendee.objects.filter(event_id__gt=last).order_by('event_id')
+                    .values_list('event_id', flat=True).distinct()[:batch_size]
+                )
+                if not event_ids:
+                    return pairs
+                cursor.execute(sql, [last, event_ids[-1]])
+                pairs += cursor.rowcount
+                last = event_ids[-1]
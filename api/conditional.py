@@ -0,0 +1,133 @@
+"""
+Conditional GET support for the polled read endpoints.
+
+Each endpoint supplies a validator function that computes its ETag and
+Last-Modified from one aggregate query over ``Event.last_modified``. When the
+client's ``If-None-Match`` / ``If-Modified-Since`` still match, a 304 is sent
+without the view loading or serializing any rows.
+"""
+
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Event
+
+
+def _etag(*parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _one_event(user_id, event_id):
+    return Event.objects.filter(id=event_id, owner_id=user_id).values_list('last_modified', flat=True)
+
+
+def _event(event_id):
+    return Event.objects.filter(id=event_id).values_list('last_modified', flat=True)
+
+
+def _user_events(user_id):
+    return Event.objects.filter(owner_id=user_id)
+
+
+# The count catches deletions, which don't move the latest timestamp.
+USER_EVENTS_STATE = {'latest': Max('last_modified'), 'count': Count('id')}
+
+
+def _from_last_modified(request, last_modified):
+    if last_modified is None:
+        return None
+    return _etag(request.get_full_path(), last_modified), last_modified
+
+
+def _from_state(request, state):
+    return _etag(request.get_full_path(), state['latest'], state['count']), state['latest']
+
+
+def one_event_validators(request, user_id, event_id):
+    return _from_last_modified(request, _one_event(user_id, event_id).first())
+
+
+def event_attendees_validators(request, event_id):
+    return _from_last_modified(request, _event(event_id).first())
+
+
+def user_events_validators(request, user_id):
+    return _from_state(request, _user_events(user_id).aggregate(**USER_EVENTS_STATE))
+
+
+async def aone_event_validators(request, user_id, event_id):
+    return _from_last_modified(request, await _one_event(user_id, event_id).afirst())
+
+
+async def aevent_attendees_validators(request, event_id):
+    return _from_last_modified(request, await _event(event_id).afirst())
+
+
+async def auser_events_validators(request, user_id):
+    return _from_state(request, await _user_events(user_id).aaggregate(**USER_EVENTS_STATE))
+
+
+def _check(request, result):
+    """
+    Return ``(response, etag, timestamp)``, ``response`` being a 304 (or
+    412) when the client's validators still match.
+    """
+    etag, last_modified = result
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp), etag, timestamp
+
+
+def _add_validators(response, etag, timestamp):
+    response.headers.setdefault('ETag', etag)
+    if timestamp is not None and not response.has_header('Last-Modified'):
+        response.headers['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def conditional(validators):
+    """
+    Answer conditional GETs with a 304 when ``validators`` says nothing changed.
+
+    ``validators(request, **kwargs)`` returns ``(etag, last_modified)``, or
+    ``None`` to hand the request to the view unconditionally. Async views take
+    async validators.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+
+                result = await validators(request, **kwargs)
+                if result is None:
+                    return await view(request, *args, **kwargs)
+                response, etag, timestamp = _check(request, result)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                return _add_validators(response, etag, timestamp)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            result = validators(request, **kwargs)
+            if result is None:
+                return view(request, *args, **kwargs)
+            response, etag, timestamp = _check(request, result)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            return _add_validators(response, etag, timestamp)
+        return wrapper
+    return decorator
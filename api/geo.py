@@ -0,0 +1,282 @@
+"""
+Event coordinates and proximity search without a spatial database.
+
+Every event with coordinates stores their geohash, a base32 string where
+each character narrows the cell down, so nearby points share a prefix and
+one geohash cell is one index range. A radius query covers the circle's
+bounding box with at most MAX_CELLS cells, reads the candidates in those
+ranges from event_geohash_idx (which also holds date_time and the
+coordinates, so the table itself isn't read), then computes the exact
+haversine distance of each one. numpy is an optional speed-up and not in
+requirements.txt: when it is installed the distances are computed as
+arrays, otherwise distances_km() falls back to a pure-Python loop with the
+same results, which is plenty for the few hundred candidates of a query.
+
+Only the nearest events are returned, so the search starts with a circle
+of about MIN_SEARCH_KM and doubles it until it holds enough of them. A
+radius query in a city with tens of thousands of events reads the few
+hundred around the point instead of all of them.
+
+Events without explicit coordinates get those of their location from the
+offline gazetteer in api/data/gazetteer.csv ("City, ST" or "City, CC").
+"""
+
+import csv
+import heapq
+import math
+import os
+import re
+from functools import lru_cache
+
+from django.db.models import Q
+
+from .models import Event
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# About 5 x 5 m, well below what a venue needs
+GEOHASH_PRECISION = 9
+# Cells one radius query may read. Fewer cells mean larger, coarser ones.
+MAX_CELLS = 16
+# Radius of the first circle nearby_events() searches
+MIN_SEARCH_KM = 1.0
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+GAZETTEER = os.path.join(os.path.dirname(__file__), 'data', 'gazetteer.csv')
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    Return the ``(height, width)`` of a geohash cell in degrees.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Return ``(south, north, west, east)`` around the circle, in degrees.
+    West is greater than east when the box crosses the antimeridian. Near
+    the poles the box spans every longitude.
+    """
+    delta_lat = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - delta_lat, -90.0), min(latitude + delta_lat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_lat <= 0 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        return south, north, -180.0, 180.0
+    delta_lon = radius_km / (KM_PER_DEGREE * cos_lat)
+    west = (longitude - delta_lon + 180) % 360 - 180
+    east = (longitude + delta_lon + 180) % 360 - 180
+    return south, north, west, east
+
+
+def _cell_indexes(south, north, west, east, height, width):
+    """
+    Return the row and column indexes of the cells of this size the box
+    touches, as ranges. Columns past the last one wrap around.
+    """
+    rows = range(int((south + 90) // height), int(min(north + 90, 180 - height / 2) // height) + 1)
+    first = int((west + 180) // width)
+    last = int(min(east + 180, 360 - width / 2) // width)
+    if last < first:
+        last += round(360 / width)
+    return rows, range(first, last + 1)
+
+
+def covering_cells(south, north, west, east):
+    """
+    Return the geohash prefixes of the fewest, smallest cells (at most
+    MAX_CELLS) that cover the box.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows, columns = _cell_indexes(south, north, west, east, height, width)
+        if len(rows) * len(columns) <= MAX_CELLS or precision == 1:
+            return sorted({
+                encode(-90 + (row + 0.5) * height, (-180 + (column + 0.5) * width + 180) % 360 - 180, precision)
+                for row in rows for column in columns
+            })
+
+
+def cells_query(cells):
+    """
+    Q matching the events whose geohash starts with any of ``cells``, as
+    index ranges: startswith compiles to a LIKE that SQLite won't use an
+    index for.
+    """
+    query = Q()
+    for cell in cells:
+        # '{' sorts right after 'z', the last geohash character
+        query |= Q(geohash__gte=cell, geohash__lt=cell + '{')
+    return query
+
+
+def distances_km(latitude, longitude, latitudes, longitudes):
+    """
+    Haversine distances from one point to each of ``latitudes`` and
+    ``longitudes``, as numpy arrays if it is installed, else in a loop.
+    """
+    if numpy is not None:
+        lat1, lon1 = numpy.radians(latitude), numpy.radians(longitude)
+        lat2 = numpy.radians(numpy.asarray(latitudes, dtype=float))
+        lon2 = numpy.radians(numpy.asarray(longitudes, dtype=float))
+        a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+        return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))).tolist()
+
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    cos_lat1 = math.cos(lat1)
+    distances = []
+    for lat2, lon2 in zip(latitudes, longitudes):
+        lat2, lon2 = math.radians(lat2), math.radians(lon2)
+        a = math.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+
+def normalize_location(location):
+    return re.sub(r'\s*,\s*', ', ', re.sub(r'\s+', ' ', location.strip().lower()))
+
+
+@lru_cache(maxsize=1)
+def gazetteer():
+    with open(GAZETTEER, newline='', encoding='utf-8') as f:
+        return {
+            normalize_location(row['location']): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(f)
+        }
+
+
+def geocode(location):
+    """
+    Return the ``(latitude, longitude)`` of a free-text location such as
+    "San Antonio, TX" or "San Antonio, TX, USA", or None when the gazetteer
+    doesn't know it.
+    """
+    if not location:
+        return None
+    places = gazetteer()
+    parts = normalize_location(location).split(', ')
+    for length in range(len(parts), 1, -1):
+        coordinates = places.get(', '.join(parts[:length]))
+        if coordinates is not None:
+            return coordinates
+    return None
+
+
+def clean_coordinates(latitude, longitude):
+    """
+    Validate coordinates sent by a client. Return them as floats, or
+    ``(None, None)`` when neither was sent. Raise ValueError otherwise.
+    """
+    if latitude is None and longitude is None:
+        return None, None
+    if latitude is None or longitude is None:
+        raise ValueError('latitude and longitude must be sent together')
+    if isinstance(latitude, bool) or isinstance(longitude, bool):
+        raise ValueError('latitude and longitude must be numbers')
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError('latitude and longitude must be numbers')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('latitude must be within [-90, 90] and longitude within [-180, 180]')
+    return latitude, longitude
+
+
+def locate(latitude, longitude, location):
+    """
+    Return the ``(latitude, longitude, geohash)`` to store for an event:
+    its own coordinates, else its location's, else three Nones.
+    """
+    if latitude is None or longitude is None:
+        latitude, longitude = geocode(location) or (None, None)
+    if latitude is None:
+        return None, None, None
+    return latitude, longitude, encode(latitude, longitude)
+
+
+def _nearest_within(latitude, longitude, radius_km, start, end, limit):
+    south, north, west, east = bounding_box(latitude, longitude, radius_km)
+    # The cells cover more than the box. Both conditions are checked in
+    # the index, the rows outside it never reach Python.
+    events = Event.objects.filter(
+        cells_query(covering_cells(south, north, west, east)), latitude__range=(south, north),
+    )
+    if west <= east:
+        events = events.filter(longitude__range=(west, east))
+    if start is not None:
+        events = events.filter(date_time__gte=start)
+    if end is not None:
+        events = events.filter(date_time__lt=end)
+    rows = list(events.order_by().values_list('latitude', 'longitude', 'date_time', 'id'))
+    if not rows:
+        return []
+    latitudes, longitudes, dates, ids = zip(*rows)
+    distances = distances_km(latitude, longitude, latitudes, longitudes)
+    nearest = heapq.nsmallest(limit, (
+        (distance, date_time, event_id)
+        for distance, date_time, event_id in zip(distances, dates, ids)
+        if distance <= radius_km
+    ))
+    return [(event_id, distance) for distance, date_time, event_id in nearest]
+
+
+def nearby_events(latitude, longitude, radius_km, start=None, end=None, limit=20):
+    """
+    Return ``(event_id, distance_km)`` of the ``limit`` events nearest to
+    the point within ``radius_km``, nearest first, then earliest first.
+    ``start`` and ``end`` bound ``date_time`` (end excluded).
+    """
+    search_km = radius_km
+    while search_km / 2 >= MIN_SEARCH_KM:
+        search_km /= 2
+    while True:
+        nearest = _nearest_within(latitude, longitude, search_km, start, end, limit)
+        # Everything outside the circle is farther than what's in it
+        if len(nearest) >= limit or search_km >= radius_km:
+            return nearest
+        search_km = min(search_km * 2, radius_km)
+
+
+def geocode_missing(events):
+    """
+    Give the events of queryset ``events`` that have no coordinates those
+    of their location, one UPDATE per distinct location the gazetteer
+    knows. Return how many were located.
+    """
+    events = events.filter(latitude__isnull=True)
+    located = 0
+    for location in list(events.order_by().values_list('location', flat=True).distinct()):
+        latitude, longitude, geohash = locate(None, None, location)
+        if latitude is not None:
+            located += events.filter(location=location).update(
+                latitude=latitude, longitude=longitude, geohash=geohash,
+            )
+    return located
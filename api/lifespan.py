@@ -0,0 +1,79 @@
+"""
+The ASGI lifespan protocol, for uvicorn workers (SERVER_MODE=asgi).
+
+A uvicorn worker told to stop waits for its open responses to finish, runs
+the lifespan shutdown, then kills itself by raising the signal it got again
+with the default handler. So:
+
+- Live streams only end when their client leaves, and the worker would wait
+  for them until gunicorn's graceful_timeout killed it. On startup, the
+  server's handlers for the shutdown signals are chained to one that ends
+  the streams.
+- gunicorn's worker_exit hook and atexit never run. What they do for sync
+  workers, writing out the write-behind queue and a last metrics snapshot,
+  is done on lifespan shutdown, after the last response.
+"""
+
+import asyncio
+import signal
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .live import close_streams
+from .metrics import write_snapshot
+from .writebehind import drain
+
+SHUTDOWN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+def chain_signals(signals, callback, loop):
+    """
+    Have ``signals`` also call ``callback`` on ``loop``, after the handler
+    installed for them, when there is one.
+    """
+    # Handlers can only be set from the main thread
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signum in signals:
+        previous = signal.getsignal(signum)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            previous(signum, frame)
+            loop.call_soon_threadsafe(callback)
+
+        signal.signal(signum, handler)
+
+
+def shutdown():
+    drain()
+    if settings.API_METRICS_DIR:
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+class Lifespan:
+    """
+    Answer lifespan messages, pass every other request to ``app``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await self.app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                chain_signals(SHUTDOWN_SIGNALS, close_streams, asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await sync_to_async(shutdown)()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
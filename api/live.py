@@ -0,0 +1,350 @@
+"""
+Live attendance of an event as Server-Sent Events, at api/events/<id>/live.
+
+Every committed change to an event's attendees is published once per
+transaction, as one ``attendance`` message: the users who joined and left
+and the new attendee_count (see attendance.apply_attendance_changes). The
+message is encoded once and handed to a broker, which passes it to the hub
+of every worker. A hub appends it to the buffer of each stream of that
+event.
+
+A stream is a coroutine waiting on an asyncio.Event, with a small buffer:
+an idle one costs a few kilobytes, not a thread. That's why LiveEvents
+serves it as a bare ASGI app in front of Django. Django 4.2 keeps iterating
+a streaming response after its client went away, and uvicorn drops what's
+sent to a closed connection. Here the stream watches receive() for the
+disconnect and ends. A worker shutting down ends its streams too (see
+api/lifespan.py).
+
+Brokers:
+
+- LocalBroker passes messages to the hubs attached to it in this process.
+  It is the default, and tests attach a hub per simulated worker to one.
+- SocketBroker, used when API_LIVE_DIR is set (gunicorn.conf.py sets it),
+  gives each worker with streams a Unix datagram socket in that directory
+  and sends every message to all of them. Delivery is best effort: a
+  message a full socket can't take is dropped. The next one carries the
+  current count again.
+"""
+
+import asyncio
+import atexit
+import glob
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+
+from .models import Event
+
+# Largest message a SocketBroker sends, well under Linux's default socket
+# buffer
+MAX_DATAGRAM = 65000
+EVENT_ID = struct.Struct('!q')
+
+_broker = None
+_hub = None
+_lock = threading.Lock()
+
+
+def encode(event_id, attendee_count, joined=(), left=()):
+    data = json.dumps({
+        'event_id': event_id,
+        'attendee_count': attendee_count,
+        'joined': sorted(joined),
+        'left': sorted(left),
+    }, separators=(',', ':'))
+    return ('event: attendance\ndata: %s\n\n' % data).encode()
+
+
+class Subscription:
+    __slots__ = ('event_id', 'chunks', 'ready', 'closed')
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        # A slow client loses the oldest messages; the newest has the count
+        self.chunks = deque(maxlen=settings.API_LIVE_BUFFER)
+        self.ready = asyncio.Event()
+        self.closed = False
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def take(self):
+        body = b''.join(self.chunks)
+        self.chunks.clear()
+        self.ready.clear()
+        return body
+
+
+class Hub:
+    """
+    The streams of one worker, by event id. They all live on the worker's
+    event loop; deliver() may be called from any thread.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._loop = None
+        self.closed = False
+
+    def __len__(self):
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def subscribe(self, event_id):
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(event_id)
+        if self.closed:
+            subscription.close()
+        self._subscriptions.setdefault(event_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.event_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.event_id]
+
+    def deliver(self, event_id, chunk):
+        # One call into the loop per message, however many streams it has
+        if event_id in self._subscriptions:
+            try:
+                self._loop.call_soon_threadsafe(self._fan_out, event_id, chunk)
+            except RuntimeError:
+                # The loop is closed, its streams are gone
+                pass
+
+    def _fan_out(self, event_id, chunk):
+        for subscription in self._subscriptions.get(event_id, ()):
+            subscription.push(chunk)
+
+    def close(self):
+        """
+        End every stream, for a worker that is shutting down. A stream
+        opened later ends after its first message.
+        """
+        self.closed = True
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.close()
+
+
+class LocalBroker:
+    def __init__(self):
+        self.hubs = []
+
+    def attach(self, hub):
+        self.hubs.append(hub)
+
+    def publish(self, event_id, chunk):
+        for hub in self.hubs:
+            hub.deliver(event_id, chunk)
+
+
+class SocketBroker:
+    def __init__(self, directory):
+        self.directory = directory
+        self.hubs = []
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        self._receiver = None
+        self._peers = []
+        self._listed = 0
+
+    def attach(self, hub):
+        self.hubs.append(hub)
+        if self._receiver is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._receiver.bind(os.path.join(self.directory, '%s-%s.sock' % (os.getpid(), id(self))))
+            threading.Thread(target=self._receive_forever, name='api-live-receive', daemon=True).start()
+            atexit.register(self.close)
+            self._listed = 0
+
+    def _peer_paths(self):
+        # Workers come and go; the directory is listed at most once a second
+        if time.monotonic() - self._listed > 1:
+            self._peers = glob.glob(os.path.join(self.directory, '*.sock'))
+            self._listed = time.monotonic()
+        return self._peers
+
+    def publish(self, event_id, chunk):
+        message = EVENT_ID.pack(event_id) + chunk
+        if len(message) > MAX_DATAGRAM:
+            return
+        for path in self._peer_paths():
+            try:
+                self._sender.sendto(message, path)
+            except BlockingIOError:
+                # Its worker is behind, the message is dropped
+                pass
+            except ConnectionRefusedError:
+                # Left behind by a worker that was killed
+                self._listed = 0
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                self._listed = 0
+
+    def _receive_forever(self):
+        while True:
+            try:
+                message = self._receiver.recv(MAX_DATAGRAM)
+            except OSError:
+                # Closed
+                return
+            event_id, = EVENT_ID.unpack_from(message)
+            for hub in self.hubs:
+                hub.deliver(event_id, message[EVENT_ID.size:])
+
+    def close(self):
+        if self._receiver is not None:
+            path = self._receiver.getsockname()
+            self._receiver.close()
+            self._receiver = None
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def get_broker():
+    # One per process: a forked worker makes its own
+    global _broker
+    with _lock:
+        if _broker is None or _broker[0] != os.getpid():
+            broker = SocketBroker(settings.API_LIVE_DIR) if settings.API_LIVE_DIR else LocalBroker()
+            _broker = (os.getpid(), broker)
+        return _broker[1]
+
+
+def get_hub():
+    global _hub
+    broker = get_broker()
+    with _lock:
+        if _hub is None or _hub[0] != os.getpid():
+            hub = Hub()
+            broker.attach(hub)
+            _hub = (os.getpid(), hub)
+        return _hub[1]
+
+
+def close_streams():
+    """
+    End the streams of this process's hub, if it has one. Runs on the
+    worker's event loop.
+    """
+    if _hub is not None and _hub[0] == os.getpid():
+        _hub[1].close()
+
+
+def publish(counts, joined=(), left=()):
+    """
+    Publish the attendance changes of one transaction: ``counts`` maps the
+    changed events to their new attendee_count, ``joined`` and ``left`` are
+    ``(user_id, event_id)`` pairs.
+    """
+    users = {event_id: ([], []) for event_id in counts}
+    for index, pairs in enumerate((joined, left)):
+        for user_id, event_id in pairs:
+            # An event deleted in between has no count
+            if event_id in users:
+                users[event_id][index].append(user_id)
+    broker = get_broker()
+    for event_id, attendee_count in counts.items():
+        broker.publish(event_id, encode(event_id, attendee_count, *users[event_id]))
+
+
+def _attendee_count(event_id):
+    # What request_started does for Django's own requests
+    close_old_connections()
+    return Event.objects.filter(id=event_id).values_list('attendee_count', flat=True).first()
+
+
+async def _watch(receive, subscription):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    subscription.close()
+
+
+async def _send_json(send, status, data):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+    ]})
+    await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+
+async def stream(event_id, receive, send):
+    hub = get_hub()
+    # Subscribed before the count is read, so no change falls in between
+    subscription = hub.subscribe(event_id)
+    watcher = None
+    try:
+        attendee_count = await sync_to_async(_attendee_count)(event_id)
+        if attendee_count is None:
+            await _send_json(send, 404, {'error': 'Event not found'})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Don't let a proxy buffer the stream
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*'),
+        ]})
+        await send({
+            'type': 'http.response.body', 'body': encode(event_id, attendee_count), 'more_body': True,
+        })
+        watcher = asyncio.ensure_future(_watch(receive, subscription))
+        while True:
+            try:
+                await asyncio.wait_for(subscription.ready.wait(), settings.API_LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                body = b': keepalive\n\n'
+            else:
+                if subscription.closed:
+                    if not watcher.done():
+                        # Closed by the hub, the client is still there: end
+                        # the response so it reconnects to another worker
+                        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                    return
+                body = subscription.take()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        hub.unsubscribe(subscription)
+        if watcher is not None:
+            watcher.cancel()
+
+
+class LiveEvents:
+    """
+    Serve GET api/events/<id>/live, pass every other request to ``app``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'].endswith('/live'):
+            try:
+                match = resolve(scope['path'])
+            except Resolver404:
+                match = None
+            if match is not None and match.url_name == 'live_event':
+                return await stream(match.kwargs['event_id'], receive, send)
+        return await self.app(scope, receive, send)
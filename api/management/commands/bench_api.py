@@ -0,0 +1,493 @@
+import json
+import logging
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from api.attendance import join_many
+from api.benchmarking import isolated_database, summarize
+from api.geo import geocode
+from api.management.commands.seed_load import ARTIST_NOUNS, ARTIST_WORDS, CITIES
+from api.models import Attendee, Event
+from api.tokens import issue_token
+
+# Endpoints timed by the concurrent mode
+WRITE_ENDPOINTS = ('create_event', 'join_event', 'leave_event')
+
+# Hashing a password is most of their time, on purpose
+MAX_REQUESTS = {'create_user': 20, 'login_user': 20}
+
+
+class Workload:
+    """
+    Builds the requests for each endpoint against the seeded data. Every
+    method returns ``count`` requests as ``(method, path, body, before)``
+    tuples. ``before(client)``, when set, runs untimed ahead of the request.
+    Whatever a request needs to succeed (users to join, attendees to remove,
+    events to delete) is created here, untimed.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.event_ids = list(Event.objects.values_list('id', flat=True))
+        self.owner_id = (
+            Event.objects.values('owner').annotate(events=Count('id')).order_by('-events')[0]['owner']
+        )
+        self.owner_event_ids = list(Event.objects.filter(owner_id=self.owner_id).values_list('id', flat=True))
+        self.popular_event_id, self.popular_concert_id = (
+            Event.objects.order_by('-attendee_count').values_list('id', 'concert_id')[0]
+        )
+        self.user = User.objects.order_by('id').first()
+        # Owns the events the write benchmarks create, so the reads see the
+        # same data whichever endpoints ran before them
+        self.writer_id = User.objects.create(username='bench-api-writer').id
+        self.created = 0
+
+    def describe(self):
+        return {
+            'owner_events': len(self.owner_event_ids),
+            'popular_event_attendees': Event.objects.get(id=self.popular_event_id).attendee_count,
+        }
+
+    def unique(self):
+        self.created += 1
+        return self.created
+
+    def new_users(self, count):
+        start = self.unique()
+        self.created += count
+        User.objects.bulk_create([User(username='bench-api-%s' % (start + i)) for i in range(count)])
+        return list(
+            User.objects.filter(username__in=['bench-api-%s' % (start + i) for i in range(count)])
+            .values_list('id', flat=True)
+        )
+
+    def new_event(self):
+        i = self.unique()
+        return {
+            'venue_name': 'Bench Venue',
+            'event_name': 'Bench Event %s' % i,
+            'date_time': (timezone.now() + timezone.timedelta(days=i % 365)).isoformat(),
+            'artist': 'Bench Artist',
+            'location': 'Bench City',
+            'spotify_artist_id': 'bench-spotify',
+            'ticketmaster_event_id': 'bench-ticketmaster-%s' % i,
+        }
+
+    def random_events(self, count):
+        return self.rng.sample(self.event_ids, count)
+
+    def login(self, client):
+        if settings.API_AUTH_MODE == 'token':
+            client.defaults['HTTP_AUTHORIZATION'] = 'Bearer ' + issue_token(self.user)
+        else:
+            client.force_login(self.user)
+
+    # Writes
+
+    def create_event(self, count):
+        path = reverse('create_event', kwargs={'user_id': self.writer_id})
+        return [('post', path, self.new_event(), None) for _ in range(count)]
+
+    def bulk_create_events(self, count):
+        path = reverse('bulk_create_events', kwargs={'user_id': self.writer_id})
+        return [('post', path, [self.new_event() for _ in range(100)], None) for _ in range(count)]
+
+    def delete_event(self, count):
+        events = [Event(owner_id=self.writer_id, date_time=timezone.now(), **{
+            key: value for key, value in self.new_event().items() if key != 'date_time'
+        }) for _ in range(count)]
+        Event.objects.bulk_create(events)
+        event_ids = Event.objects.filter(ticketmaster_event_id__in=[event.ticketmaster_event_id for event in events])
+        return [
+            ('delete', reverse('delete_event', kwargs={'user_id': self.writer_id, 'event_id': event_id}), None, None)
+            for event_id in event_ids.values_list('id', flat=True)
+        ]
+
+    def join_event(self, count):
+        return [
+            ('post', reverse('join_event', kwargs={'user_id': user_id, 'event_id': event_id}), None, None)
+            for user_id, event_id in zip(self.new_users(count), self.random_events(count))
+        ]
+
+    def leave_event(self, count):
+        requests = []
+        for user_id, event_id in zip(self.new_users(count), self.random_events(count)):
+            join_many([user_id], [event_id])
+            requests.append(
+                ('post', reverse('leave_event', kwargs={'user_id': user_id, 'event_id': event_id}), None, None)
+            )
+        return requests
+
+    def join_events(self, count):
+        return [
+            ('post', reverse('join_events', kwargs={'user_id': user_id}), {'event_ids': self.random_events(10)}, None)
+            for user_id in self.new_users(count)
+        ]
+
+    def leave_events(self, count):
+        requests = []
+        for user_id in self.new_users(count):
+            event_ids = self.random_events(10)
+            join_many([user_id], event_ids)
+            requests.append(('post', reverse('leave_events', kwargs={'user_id': user_id}), {'event_ids': event_ids}, None))
+        return requests
+
+    def join_users_to_event(self, count):
+        requests = []
+        for event_id in self.random_events(count):
+            path = reverse('join_users_to_event', kwargs={'event_id': event_id})
+            requests.append(('post', path, {'user_ids': self.new_users(10)}, None))
+        return requests
+
+    def remove_users_from_event(self, count):
+        requests = []
+        for event_id in self.random_events(count):
+            user_ids = self.new_users(10)
+            join_many(user_ids, [event_id])
+            path = reverse('remove_users_from_event', kwargs={'event_id': event_id})
+            requests.append(('post', path, {'user_ids': user_ids}, None))
+        return requests
+
+    # Reads
+
+    def user_events(self, count):
+        path = reverse('user_events', kwargs={'user_id': self.owner_id})
+        return [('get', path, None, None)] * count
+
+    def user_events_stream(self, count):
+        path = reverse('user_events', kwargs={'user_id': self.owner_id}) + '?stream=1'
+        return [('get', path, None, None)] * count
+
+    def user_feed(self, count):
+        path = reverse('user_feed', kwargs={'user_id': self.owner_id})
+        return [('get', path, None, None)] * count
+
+    def one_event(self, count):
+        return [
+            ('get', reverse('one_event', kwargs={'user_id': self.owner_id, 'event_id': event_id}), None, None)
+            for event_id in self.rng.choices(self.owner_event_ids, k=count)
+        ]
+
+    def users_attending_event(self, count):
+        path = reverse('users_attending_event', kwargs={'event_id': self.popular_event_id})
+        return [('get', path, None, None)] * count
+
+    def users_attending_event_stream(self, count):
+        path = reverse('users_attending_event', kwargs={'event_id': self.popular_event_id}) + '?stream=1'
+        return [('get', path, None, None)] * count
+
+    def related_events(self, count):
+        path = reverse('related_events', kwargs={'event_id': self.popular_event_id})
+        return [('get', path, None, None)] * count
+
+    def recommendations(self, count):
+        # Attendees of the most popular event, who attend the most events
+        user_ids = list(
+            Attendee.objects.filter(event_id=self.popular_event_id).values_list('user_id', flat=True)[:count]
+        )
+        return [
+            ('get', reverse('recommendations', kwargs={'user_id': user_id}), None, None)
+            for user_id in self.rng.choices(user_ids, k=count)
+        ]
+
+    def concert(self, count):
+        return [('get', reverse('concert', kwargs={'concert_id': self.popular_concert_id}), None, None)] * count
+
+    def concert_attendees(self, count):
+        path = reverse('concert_attendees', kwargs={'concert_id': self.popular_concert_id})
+        return [('get', path, None, None)] * count
+
+    def search_events(self, count):
+        # An artist word prefix alone, or with an artist noun or city word
+        requests = []
+        for _ in range(count):
+            words = [self.rng.choice(ARTIST_WORDS)[:4]]
+            if self.rng.random() < 0.5:
+                words.append(self.rng.choice(ARTIST_NOUNS + CITIES).split(',')[0])
+            path = reverse('search_events') + '?' + urlencode({'q': ' '.join(words), 'limit': 20})
+            requests.append(('get', path, None, None))
+        return requests
+
+    def nearby_events(self, count):
+        # Around a seeded city's center
+        requests = []
+        for _ in range(count):
+            latitude, longitude = geocode(self.rng.choice(CITIES))
+            query = urlencode({'lat': latitude, 'lon': longitude, 'radius_km': 25, 'limit': 20})
+            requests.append(('get', reverse('nearby_events') + '?' + query, None, None))
+        return requests
+
+    def cache_stats(self, count):
+        return [('get', reverse('cache_stats'), None, None)] * count
+
+    def metrics(self, count):
+        return [('get', reverse('metrics'), None, None)] * count
+
+    # Users
+
+    def create_user(self, count):
+        requests = []
+        for _ in range(count):
+            i = self.unique()
+            body = {'username': 'bench-api-new-%s' % i, 'email': 'new-%s@example.com' % i, 'password': 'bench-api'}
+            requests.append(('post', reverse('create_user'), body, None))
+        return requests
+
+    def login_user(self, count):
+        body = {'username': self.user.username, 'password': 'load-password'}
+        return [('post', reverse('login_user'), body, None)] * count
+
+    def current_session(self, count):
+        return [('get', reverse('current_session'), None, self.login)] * count
+
+    def logout_user(self, count):
+        return [('post', reverse('logout_user'), None, self.login)] * count
+
+    def refresh_token(self, count):
+        return [('post', reverse('refresh_token'), None, self.login)] * count
+
+
+ENDPOINTS = (
+    'create_event', 'bulk_create_events', 'join_event', 'leave_event', 'join_events', 'leave_events',
+    'join_users_to_event', 'remove_users_from_event', 'user_events', 'user_events_stream', 'user_feed',
+    'one_event', 'delete_event', 'users_attending_event', 'users_attending_event_stream', 'search_events',
+    'nearby_events', 'related_events', 'recommendations', 'concert', 'concert_attendees', 'cache_stats', 'metrics', 'create_user', 'login_user', 'current_session', 'logout_user',
+    'refresh_token',
+)
+
+
+def send(client, method, path, body):
+    if body is None:
+        response = getattr(client, method)(path)
+    else:
+        response = getattr(client, method)(path, json.dumps(body), content_type='application/json')
+    if response.streaming:
+        for _ in response:
+            pass
+    return response.status_code
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting the queries run while ``counting`` is set.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.counting = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.counting:
+            self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def run(requests, cold_cache):
+    """
+    Send ``requests`` one after the other and return the latencies, the
+    status codes and the number of queries.
+    """
+    client = Client(raise_request_exception=False)
+    counter = QueryCounter()
+    latencies, statuses = [], Counter()
+    with connection.execute_wrapper(counter):
+        for method, path, body, before in requests:
+            if before is not None:
+                before(client)
+            if cold_cache:
+                cache.clear()
+            counter.counting = True
+            start = time.perf_counter()
+            statuses[send(client, method, path, body)] += 1
+            latencies.append(time.perf_counter() - start)
+            counter.counting = False
+    return latencies, statuses, counter.queries
+
+
+def allocations(requests, cold_cache):
+    """
+    Mean peak of memory allocated while handling each request, in KiB.
+    Traced separately: tracemalloc slows everything down.
+    """
+    client = Client(raise_request_exception=False)
+    peaks = []
+    for method, path, body, before in requests:
+        if before is not None:
+            before(client)
+        if cold_cache:
+            cache.clear()
+        tracemalloc.start()
+        try:
+            send(client, method, path, body)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return sum(peaks) / len(peaks) / 1024 if peaks else 0.0
+
+
+def result(latencies, statuses, queries, elapsed):
+    summary = summarize(latencies, sum(count for status, count in statuses.items() if status >= 500), elapsed)
+    summary['statuses'] = {str(status): count for status, count in sorted(statuses.items())}
+    summary['queries_per_request'] = queries / len(latencies) if latencies else 0.0
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API view in-process through the Django test client "
+        "against a throwaway database seeded with seed_load. Reports p50/p95/"
+        "p99 latency, requests per second, queries per request and memory "
+        "allocated per request for each endpoint. --concurrency also times the "
+        "write endpoints from a thread pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*', help='Only benchmark these endpoints.')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint.')
+        parser.add_argument('--memory-requests', type=int, default=10, help='Requests traced for allocations.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per endpoint first.')
+        parser.add_argument(
+            '--concurrency', type=int, default=0,
+            help='Threads sending %s concurrently (0: no concurrent run).' % ', '.join(WRITE_ENDPOINTS)
+        )
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help="Leave the response cache alone. By default it's cleared before each request, so reads hit the database."
+        )
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--events', type=int, default=1000)
+        parser.add_argument('--max-attendees', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'] or [
+            name for name in ENDPOINTS if name != 'refresh_token' or settings.API_AUTH_MODE == 'token'
+        ]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError('Unknown endpoints: %s' % ', '.join(sorted(unknown)))
+        cold_cache = not options['warm_cache']
+
+        # The test client's host, and no log entry for every 4xx response
+        quiet = logging.getLogger('django.request')
+        with isolated_database(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            quiet.disabled = True
+            call_command(
+                'seed_load', '--users', str(options['users']), '--events', str(options['events']),
+                '--max-attendees', str(options['max_attendees']), '--seed', str(options['seed']),
+                stdout=StringIO(),
+            )
+            workload = Workload(random.Random(options['seed']))
+            results = {'meta': self.meta(options, workload), 'endpoints': {}, 'concurrent': {}}
+
+            for name in endpoints:
+                count = min(options['requests'], MAX_REQUESTS.get(name, options['requests']))
+                build = getattr(workload, name)
+                run(build(min(options['warmup'], count)), cold_cache)
+                requests = build(count)
+                started = time.perf_counter()
+                latencies, statuses, queries = run(requests, cold_cache)
+                summary = result(latencies, statuses, queries, time.perf_counter() - started)
+                summary['alloc_peak_kib'] = allocations(
+                    build(min(options['memory_requests'], count)), cold_cache
+                )
+                results['endpoints'][name] = summary
+                if not options['json']:
+                    self.report(name, summary)
+
+            if options['concurrency'] > 0:
+                for name in WRITE_ENDPOINTS:
+                    if name not in endpoints:
+                        continue
+                    summary = self.concurrent(getattr(workload, name)(options['requests']), options['concurrency'])
+                    results['concurrent'][name] = summary
+                    if not options['json']:
+                        self.report('%s x%s' % (name, options['concurrency']), summary)
+            quiet.disabled = False
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def concurrent(self, requests, threads):
+        """
+        Send ``requests`` from ``threads`` threads at once, each with its own
+        client and database connection.
+        """
+        chunks = [requests[i::threads] for i in range(threads)]
+        ready = threading.Barrier(threads + 1)
+
+        def worker(chunk):
+            try:
+                ready.wait()
+                return run(chunk, cold_cache=False)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(threads) as pool:
+            futures = [pool.submit(worker, chunk) for chunk in chunks]
+            ready.wait()
+            started = time.perf_counter()
+            outcomes = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+
+        latencies, statuses, queries = [], Counter(), 0
+        for chunk_latencies, chunk_statuses, chunk_queries in outcomes:
+            latencies += chunk_latencies
+            statuses.update(chunk_statuses)
+            queries += chunk_queries
+        return result(latencies, statuses, queries, elapsed)
+
+    def meta(self, options, workload):
+        return dict(
+            revision=git_revision(),
+            python=platform.python_version(),
+            django=django.get_version(),
+            database=connection.vendor,
+            server_mode=settings.SERVER_MODE,
+            auth_mode=settings.API_AUTH_MODE,
+            cache='warm' if options['warm_cache'] else 'cold',
+            users=options['users'],
+            events=options['events'],
+            max_attendees=options['max_attendees'],
+            seed=options['seed'],
+            **workload.describe(),
+        )
+
+    def report(self, name, summary):
+        self.stdout.write(
+            '%-34s %9.1f req/s   p50 %7.2f ms   p95 %7.2f ms   p99 %7.2f ms   %5.1f queries   %8s KiB   %s' % (
+                name, summary['throughput'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+                summary['queries_per_request'],
+                '%.1f' % summary['alloc_peak_kib'] if 'alloc_peak_kib' in summary else '-',
+                ' '.join('%s:%s' % item for item in summary['statuses'].items()),
+            )
+        )
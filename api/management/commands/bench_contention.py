@@ -0,0 +1,122 @@
+import json
+import random
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+
+from api.benchmarking import free_port, isolated_database, run_load, serve, wait_until_ready
+from api.models import Event
+
+HOST = '127.0.0.1'
+
+# Server environments compared on SQLite. "rollback" is SQLite's stock
+# configuration; "wal" is the one concertmate_be/database.py sets up.
+SQLITE_PROFILES = {
+    'rollback': {
+        'SQLITE_JOURNAL_MODE': 'DELETE',
+        'SQLITE_SYNCHRONOUS': 'FULL',
+        'SQLITE_CACHE_SIZE': '-2000',
+        'SQLITE_MMAP_SIZE': '0',
+        'SQLITE_TEMP_STORE': 'DEFAULT',
+    },
+    'wal': {},
+}
+
+
+def seed(events, users):
+    owner = User.objects.create(username='contention-owner')
+    User.objects.bulk_create([User(username='contention-user-%s' % i) for i in range(users)])
+    Event.objects.bulk_create([
+        Event(
+            venue_name='Contention Venue %s' % i,
+            event_name='Contention Event %s' % i,
+            date_time=timezone.now() + timezone.timedelta(days=i),
+            artist='Contention Artist',
+            location='Contention City',
+            spotify_artist_id='contention-spotify',
+            ticketmaster_event_id='contention-ticketmaster-%s' % i,
+            owner=owner,
+        ) for i in range(events)
+    ])
+    return (
+        list(User.objects.exclude(id=owner.id).values_list('id', flat=True)),
+        list(Event.objects.values_list('id', flat=True)),
+    )
+
+
+def writes(user_ids, event_ids):
+    """
+    Return a ``next_request()`` for ``run_load()`` that joins and leaves
+    random events, so nearly every request writes.
+    """
+    def next_request():
+        name = random.choice(('join_event', 'leave_event'))
+        kwargs = {'user_id': random.choice(user_ids), 'event_id': random.choice(event_ids)}
+        return 'POST', reverse(name, kwargs=kwargs)
+    return next_request
+
+
+class Command(BaseCommand):
+    help = (
+        "Hit join_event and leave_event with concurrent writers through gunicorn "
+        "against a throwaway database. On SQLite the stock rollback-journal "
+        "configuration is compared with the WAL profile; failed writes "
+        "(\"database is locked\") show up as errors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', nargs='+', choices=tuple(SQLITE_PROFILES),
+            help='SQLite profiles to compare (default: all).'
+        )
+        parser.add_argument('--server-mode', choices=('wsgi', 'asgi'), default='wsgi')
+        parser.add_argument('--workers', type=int, default=4, help='Gunicorn workers.')
+        parser.add_argument('--concurrency', type=int, default=64, help='Concurrent writers.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per profile.')
+        parser.add_argument('--events', type=int, default=50)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the writes.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        if connection.vendor == 'sqlite':
+            profiles = {name: SQLITE_PROFILES[name] for name in options['profiles'] or SQLITE_PROFILES}
+        elif options['profiles']:
+            raise CommandError('--profiles only applies to SQLite')
+        else:
+            profiles = {connection.vendor: {}}
+
+        results = {}
+        for name, environ in profiles.items():
+            with isolated_database():
+                next_request = writes(*seed(options['events'], options['users']))
+                if connection.vendor == 'sqlite':
+                    # The journal mode is stored in the file, switch it while
+                    # nothing else has it open.
+                    journal_mode = environ.get('SQLITE_JOURNAL_MODE', settings.SQLITE_PRAGMAS['journal_mode'])
+                    with connection.cursor() as cursor:
+                        cursor.execute('PRAGMA journal_mode = %s' % journal_mode)
+                    connection.close()
+
+                port = free_port()
+                with serve(options['server_mode'], options['workers'], port, **environ):
+                    wait_until_ready(HOST, port, reverse('cache_stats'))
+                    results[name] = run_load(HOST, port, next_request, options['concurrency'], options['duration'])
+            if not options['json']:
+                self.report(name, results[name])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def report(self, name, result):
+        self.stdout.write(
+            '%-10s %8d writes %6d errors %9.1f req/s   p50 %7.1f ms   p95 %7.1f ms   p99 %7.1f ms' % (
+                name, result['requests'], result['errors'], result['throughput'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            )
+        )
@@ -0,0 +1,112 @@
+import json
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from django.utils import timezone
+
+from api.benchmarking import free_port, isolated_database, run_load, serve, wait_until_ready
+from api.models import Attendee, Event
+
+HOST = '127.0.0.1'
+
+SERVER_MODES = ('wsgi', 'asgi')
+
+
+def seed(events, users, attendees):
+    """
+    Create an owner with ``events`` events and ``users`` other users, the
+    first ``attendees`` of whom attend every event.
+    """
+    owner = User.objects.create(username='bench-owner')
+    User.objects.bulk_create([User(username='bench-user-%s' % i) for i in range(users)])
+    user_ids = list(User.objects.exclude(id=owner.id).values_list('id', flat=True))
+    Event.objects.bulk_create([
+        Event(
+            venue_name='Bench Venue %s' % i,
+            event_name='Bench Event %s' % i,
+            date_time=timezone.now() + timezone.timedelta(days=i),
+            artist='Bench Artist %s' % (i % 50),
+            location='Bench City',
+            spotify_artist_id='bench-spotify-%s' % (i % 50),
+            ticketmaster_event_id='bench-ticketmaster-%s' % i,
+            owner=owner,
+            attendee_count=min(attendees, users),
+        ) for i in range(events)
+    ])
+    event_ids = list(Event.objects.filter(owner=owner).values_list('id', flat=True))
+    Attendee.objects.bulk_create(
+        [Attendee(user_id=user_id, event_id=event_id) for event_id in event_ids for user_id in user_ids[:attendees]],
+        batch_size=1000,
+    )
+    return owner.id, event_ids, user_ids[attendees:] or user_ids
+
+
+def request_mix(owner_id, event_ids, user_ids, write_percent):
+    """
+    Return a ``next_request()`` for ``run_load()``: reads spread over the
+    three event read endpoints, plus ``write_percent`` joins and leaves.
+    """
+    def next_request():
+        event_id = random.choice(event_ids)
+        if random.random() * 100 < write_percent:
+            name = random.choice(('join_event', 'leave_event'))
+            return 'POST', reverse(name, kwargs={'user_id': random.choice(user_ids), 'event_id': event_id})
+        choice = random.random()
+        if choice < 0.5:
+            return 'GET', reverse('one_event', kwargs={'user_id': owner_id, 'event_id': event_id})
+        if choice < 0.8:
+            return 'GET', reverse('users_attending_event', kwargs={'event_id': event_id}) + '?limit=50'
+        return 'GET', reverse('user_events', kwargs={'user_id': owner_id}) + '?limit=50'
+    return next_request
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the API under gunicorn in each SERVER_MODE against a throwaway "
+        "database and compare throughput and latency percentiles at the same "
+        "concurrency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=SERVER_MODES, default=list(SERVER_MODES))
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn workers per mode.')
+        parser.add_argument('--concurrency', type=int, default=200, help='Requests kept in flight.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per mode.')
+        parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of unmeasured load first.')
+        parser.add_argument('--write-percent', type=float, default=10.0, help='Share of join/leave requests.')
+        parser.add_argument('--events', type=int, default=500)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--attendees', type=int, default=100, help='Attendees seeded per event.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the request mix.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+
+        results = {}
+        with isolated_database():
+            sample = seed(options['events'], options['users'], options['attendees'])
+            next_request = request_mix(*sample, options['write_percent'])
+
+            for mode in options['modes']:
+                port = free_port()
+                with serve(mode, options['workers'], port):
+                    wait_until_ready(HOST, port, reverse('cache_stats'))
+                    if options['warmup']:
+                        run_load(HOST, port, next_request, options['concurrency'], options['warmup'])
+                    results[mode] = run_load(HOST, port, next_request, options['concurrency'], options['duration'])
+                if not options['json']:
+                    self.report(mode, results[mode])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def report(self, mode, result):
+        self.stdout.write(
+            '%-5s %8d requests %6d errors %9.1f req/s   p50 %7.1f ms   p95 %7.1f ms   p99 %7.1f ms' % (
+                mode, result['requests'], result['errors'], result['throughput'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            )
+        )
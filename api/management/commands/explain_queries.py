@@ -0,0 +1,132 @@
+import json
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+
+from api.models import Concert, Event
+from api.profiling import STATEMENTS, explain
+
+SAMPLE_EVENT = {
+    'venue_name': 'Explain Venue',
+    'event_name': 'Explain Event',
+    'date_time': '2030-01-01T20:00:00Z',
+    'artist': 'Explain Artist',
+    'location': 'Explain City',
+    'spotify_artist_id': 'explain_spotify_artist_id',
+    'ticketmaster_event_id': 'explain_ticketmaster_event_id',
+}
+
+# (url name, method, url kwargs, JSON body (query parameters of a GET) or a
+# function of the sample ids returning one, url names to run first)
+ENDPOINTS = [
+    ('create_event', 'post', ('user_id',), SAMPLE_EVENT, ()),
+    ('bulk_create_events', 'post', ('user_id',), [SAMPLE_EVENT], ()),
+    ('join_event', 'post', ('user_id', 'event_id'), None, ()),
+    ('leave_event', 'post', ('user_id', 'event_id'), None, ('join_event',)),
+    ('join_events', 'post', ('user_id',), lambda sample: {'event_ids': [sample['event_id']]}, ()),
+    ('leave_events', 'post', ('user_id',), lambda sample: {'event_ids': [sample['event_id']]}, ('join_event',)),
+    ('join_users_to_event', 'post', ('event_id',), lambda sample: {'user_ids': [sample['user_id']]}, ()),
+    ('remove_users_from_event', 'post', ('event_id',), lambda sample: {'user_ids': [sample['user_id']]}, ('join_event',)),
+    ('user_events', 'get', ('user_id',), None, ()),
+    ('one_event', 'get', ('user_id', 'event_id'), None, ()),
+    ('user_feed', 'get', ('user_id',), None, ('join_event',)),
+    ('recommendations', 'get', ('user_id',), None, ('join_event',)),
+    ('delete_event', 'delete', ('user_id', 'event_id'), None, ()),
+    ('users_attending_event', 'get', ('event_id',), None, ()),
+    ('concert', 'get', ('concert_id',), None, ()),
+    ('concert_attendees', 'get', ('concert_id',), None, ('join_event',)),
+    ('search_events', 'get', (), {'q': 'explain'}, ()),
+    ('nearby_events', 'get', (), {'lat': 40.7128, 'lon': -74.006}, ()),
+    ('related_events', 'get', ('event_id',), None, ()),
+    ('create_user', 'post', (), {'username': 'explain-user', 'email': 'explain@example.com', 'password': 'explain'}, ()),
+    ('login_user', 'post', (), {'username': 'explain-user', 'password': 'wrong-password'}, ()),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Call every API endpoint against the current database and print the "
+        "query plan of each SQL statement it runs. Changes are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='User id to call the endpoints with.')
+        parser.add_argument('--event', type=int, help='Event id to call the endpoints with.')
+        parser.add_argument('endpoints', nargs='*', help='Only explain these url names.')
+
+    def handle(self, *args, **options):
+        sample = self.sample_ids(options['user'], options['event'])
+        factory = RequestFactory()
+        by_name = {endpoint[0]: endpoint for endpoint in ENDPOINTS}
+
+        unknown = set(options['endpoints']) - set(by_name)
+        if unknown:
+            raise CommandError('Unknown endpoints: %s' % ', '.join(sorted(unknown)))
+
+        for name, method, kwargs, body, setup in ENDPOINTS:
+            if options['endpoints'] and name not in options['endpoints']:
+                continue
+            missing = [key for key in kwargs if sample[key] is None]
+            if missing:
+                self.stdout.write(self.style.MIGRATE_HEADING('== %s skipped, no %s' % (name, ', '.join(missing))))
+                continue
+            with transaction.atomic():
+                for setup_name in setup:
+                    self.call(factory, by_name[setup_name], sample)
+                with CaptureQueriesContext(connection) as captured:
+                    path = self.call(factory, by_name[name], sample)
+                self.stdout.write(self.style.MIGRATE_HEADING('== %s %s %s' % (name, method.upper(), path)))
+                for query in captured.captured_queries:
+                    sql = query['sql']
+                    if not sql.lstrip().upper().startswith(STATEMENTS):
+                        continue
+                    self.stdout.write('-- ' + sql)
+                    for line in explain(connection, sql):
+                        self.stdout.write('   ' + line)
+                transaction.set_rollback(True)
+
+    def sample_ids(self, user_id, event_id):
+        events = Event.objects.order_by('id')
+        if user_id is not None:
+            if not User.objects.filter(id=user_id).exists():
+                raise CommandError('User %s does not exist' % user_id)
+            events = events.filter(owner_id=user_id)
+        if event_id is None:
+            event_id = events.values_list('id', flat=True).first()
+            if event_id is None:
+                raise CommandError('No events to explain, create some data first')
+        if user_id is None:
+            user_id = Event.objects.filter(id=event_id).values_list('owner_id', flat=True).first()
+            if user_id is None:
+                raise CommandError('Event %s does not exist' % event_id)
+        # The event's concert, or any when it has none
+        concert_id = Event.objects.filter(id=event_id).values_list('concert_id', flat=True).first()
+        if concert_id is None:
+            concert_id = Concert.objects.order_by('id').values_list('id', flat=True).first()
+        return {'user_id': user_id, 'event_id': event_id, 'concert_id': concert_id}
+
+    def call(self, factory, endpoint, sample):
+        name, method, kwargs, body, _ = endpoint
+        path = reverse(name, kwargs={key: sample[key] for key in kwargs})
+        if callable(body):
+            body = body(sample)
+        if body is None:
+            request = getattr(factory, method)(path)
+        elif method == 'get':
+            request = factory.get(path, body)
+        else:
+            request = getattr(factory, method)(path, json.dumps(body), content_type='application/json')
+        match = resolve(path)
+        view = match.func
+        if iscoroutinefunction(view):
+            # SERVER_MODE=asgi routes some endpoints to api.async_views
+            view = async_to_sync(view)
+        response = view(request, *match.args, **match.kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return path
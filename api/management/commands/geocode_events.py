@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.geo import geocode_missing
+from api.models import Event
+
+
+class Command(BaseCommand):
+    help = (
+        "Give the events without coordinates those of their location, looked "
+        "up in the offline gazetteer (api/data/gazetteer.csv). Run it after "
+        "adding places to the gazetteer."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            located = geocode_missing(Event.objects.all())
+        missing = Event.objects.filter(latitude__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS('Located %s events, %s have no coordinates' % (located, missing)))
@@ -0,0 +1,117 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per measurement so every import is cold. Prints
+# one JSON object: the time to import Django, set up the apps and load the
+# URLconf and WSGI handler, then the average time of a request through the
+# whole handler and of the same view called directly. The difference is the
+# cost of the middleware chain plus Django's own request handling.
+PROBE = r'''
+import json, time
+start = time.perf_counter()
+
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.urls import get_resolver, resolve
+get_resolver().url_patterns
+handler = WSGIHandler()
+booted, booted_at = time.perf_counter(), time.time()
+
+import io, sys
+from django.conf import settings
+path, requests = sys.argv[1], int(sys.argv[2])
+
+def environ():
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+        'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '80', 'HTTP_HOST': '127.0.0.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+    }
+
+def start_response(status, headers):
+    assert status.startswith('200'), status
+
+view = resolve(path).func
+for _ in range(min(requests, 100)):
+    handler(environ(), start_response)
+
+began = time.perf_counter()
+for _ in range(requests):
+    handler(environ(), start_response)
+through_handler = time.perf_counter() - began
+
+began = time.perf_counter()
+for _ in range(requests):
+    view(WSGIRequest(environ()))
+direct = time.perf_counter() - began
+
+print(json.dumps({
+    'boot_ms': (booted - start) * 1000,
+    'booted_at': booted_at,
+    'apps': len(settings.INSTALLED_APPS),
+    'middleware': len(settings.MIDDLEWARE),
+    'request_us': through_handler / requests * 1e6,
+    'view_us': direct / requests * 1e6,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold-start time (interpreter, imports, app registry and URLconf) "
+        "and per-request middleware overhead for each settings module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--settings-modules', nargs='+', default=['concertmate_be.settings', 'concertmate_be.settings_api'],
+            help='Settings modules to compare.'
+        )
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts per settings module.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests timed per run.')
+        parser.add_argument('--path', default='/api/cache/stats', help='A GET endpoint that needs no data.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        results = {}
+        for module in options['settings_modules']:
+            runs = [self.probe(module, options['path'], options['requests']) for _ in range(options['runs'])]
+            result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            result['overhead_us'] = result['request_us'] - result['view_us']
+            results[module] = result
+            if not options['json']:
+                self.report(module, result)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def probe(self, module, path, requests):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=module)
+        started_at = time.time()
+        process = subprocess.run(
+            [sys.executable, '-c', PROBE, path, str(requests)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if process.returncode:
+            raise CommandError('Probe of %s failed:\n%s' % (module, process.stderr))
+        result = json.loads(process.stdout)
+        # From spawning the interpreter to a loaded handler
+        result['process_ms'] = (result.pop('booted_at') - started_at) * 1000
+        return result
+
+    def report(self, module, result):
+        self.stdout.write(
+            '%-28s %2d apps %2d middleware   boot %6.1f ms (process %6.1f ms)   '
+            'request %6.1f us, of which handler and middleware %6.1f us' % (
+                module, result['apps'], result['middleware'], result['boot_ms'], result['process_ms'],
+                result['request_us'], result['overhead_us'],
+            )
+        )
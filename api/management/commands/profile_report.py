@@ -0,0 +1,135 @@
+import json
+import os
+import pstats
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+SORT_KEYS = {
+    'cumulative': 3,
+    'tottime': 2,
+    'ncalls': 1,
+}
+
+
+def load_captures(directory, routes):
+    captures = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            capture = json.load(f)
+        if routes and capture['route'] not in routes:
+            continue
+        capture['profile'] = os.path.join(directory, name[:-len('.json')] + '.prof')
+        captures.append(capture)
+    return captures
+
+
+def summarize_routes(captures):
+    routes = {}
+    for capture in captures:
+        durations = routes.setdefault(capture['route'], [])
+        durations.append(capture['duration_ms'])
+    return [
+        {
+            'route': route,
+            'captures': len(durations),
+            'mean_ms': sum(durations) / len(durations),
+            'max_ms': max(durations),
+        } for route, durations in sorted(routes.items(), key=lambda item: -max(item[1]))
+    ]
+
+
+def top_functions(captures, sort, top):
+    paths = [capture['profile'] for capture in captures if os.path.exists(capture['profile'])]
+    if not paths:
+        return []
+    stats = pstats.Stats(*paths).stats
+    index = SORT_KEYS[sort]
+    functions = sorted(stats.items(), key=lambda item: -item[1][index])[:top]
+    return [
+        {
+            'function': pstats.func_std_string(function),
+            'ncalls': ncalls,
+            'tottime_ms': tottime * 1000,
+            'cumtime_ms': cumtime * 1000,
+        } for function, (_, ncalls, tottime, cumtime, _) in functions
+    ]
+
+
+def top_queries(captures, top):
+    """
+    Group the slow queries by SQL, slowest in total first. Each group keeps
+    the plan of its slowest run.
+    """
+    queries = {}
+    for capture in captures:
+        for query in capture['slow_queries']:
+            group = queries.setdefault(query['sql'], {
+                'sql': query['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'routes': set(), 'plan': [],
+            })
+            group['count'] += 1
+            group['total_ms'] += query['duration_ms']
+            group['routes'].add(capture['route'])
+            if query['duration_ms'] >= group['max_ms']:
+                group['max_ms'] = query['duration_ms']
+                group['plan'] = query['plan']
+    groups = sorted(queries.values(), key=lambda group: -group['total_ms'])[:top]
+    for group in groups:
+        group['routes'] = sorted(group['routes'])
+    return groups
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the captures in API_PROFILE_DIR: the slowest routes, the "
+        "functions that took the most time across their profiles and the "
+        "slow queries with their plans."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Capture directory (default: API_PROFILE_DIR).')
+        parser.add_argument('--route', action='append', default=[], help='Only these url names. Repeatable.')
+        parser.add_argument('--sort', choices=tuple(SORT_KEYS), default='cumulative', help='Order of functions.')
+        parser.add_argument('--top', type=int, default=20, help='Functions and queries to list.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.API_PROFILE_DIR
+        if not os.path.isdir(directory):
+            raise CommandError('No captures in %s' % directory)
+        captures = load_captures(directory, options['route'])
+        report = {
+            'captures': len(captures),
+            'routes': summarize_routes(captures),
+            'functions': top_functions(captures, options['sort'], options['top']),
+            'queries': top_queries(captures, options['top']),
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.report(report)
+
+    def report(self, report):
+        self.stdout.write(self.style.MIGRATE_HEADING('== %s captures' % report['captures']))
+        for route in report['routes']:
+            self.stdout.write('%-28s %5d captures   mean %8.1f ms   max %8.1f ms' % (
+                route['route'], route['captures'], route['mean_ms'], route['max_ms'],
+            ))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('== Top functions'))
+        self.stdout.write('%9s %12s %12s  %s' % ('ncalls', 'tottime ms', 'cumtime ms', 'function'))
+        for function in report['functions']:
+            self.stdout.write('%9d %12.2f %12.2f  %s' % (
+                function['ncalls'], function['tottime_ms'], function['cumtime_ms'], function['function'],
+            ))
+
+        self.stdout.write(self.style.MIGRATE_HEADING('== Slow queries'))
+        for query in report['queries']:
+            self.stdout.write('-- %d runs, %.1f ms total, %.1f ms max (%s)' % (
+                query['count'], query['total_ms'], query['max_ms'], ', '.join(query['routes']),
+            ))
+            self.stdout.write('   ' + query['sql'])
+            for line in query['plan']:
+                self.stdout.write('     ' + line)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.profiling import issue_profile_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Print a value for the X-Profile request header. Requests sending it "
+        "are profiled until it expires (API_PROFILE_TOKEN_MAX_AGE seconds)."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(issue_profile_token())
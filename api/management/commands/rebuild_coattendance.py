@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.coattendance import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the co-attendance counts behind related events and "
+        "recommendations from the attendee table. Run it after writing "
+        "attendees around the API, such as with raw SQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Events aggregated per statement.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive integer')
+        started = time.perf_counter()
+        pairs = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Counted %s event pairs in %.1f s' % (pairs, time.perf_counter() - started)
+        ))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.cache import concert_scope, event_scope, invalidate, user_events_scope
+from api.models import Attendee, Event
+
+
+def actual_count():
+    counts = Attendee.objects.filter(event=OuterRef('pk')).order_by().values('event').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts), 0)
+
+
+class Command(BaseCommand):
+    help = (
+        "Find events whose attendee_count doesn't match their attendee rows and fix them. "
+        "Cached responses are invalidated in the configured cache, which running workers "
+        "only share when it isn't the default local-memory one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drifted events.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Events fixed per UPDATE.')
+
+    def handle(self, *args, **options):
+        drifted = list(
+            Event.objects.annotate(actual=actual_count())
+            .exclude(attendee_count=F('actual'))
+            .order_by('id')
+            .values_list('id', 'owner_id', 'concert_id', 'attendee_count', 'actual')
+        )
+        for event_id, _, _, stored, actual in drifted:
+            self.stdout.write('Event %s: attendee_count %s, %s attendees' % (event_id, stored, actual))
+
+        if options['dry_run'] or not drifted:
+            self.stdout.write('%s drifted events' % len(drifted))
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(drifted), batch_size):
+            batch = drifted[start:start + batch_size]
+            with transaction.atomic():
+                Event.objects.filter(id__in=[row[0] for row in batch]).update(
+                    attendee_count=actual_count(), last_modified=timezone.now()
+                )
+                invalidate(
+                    *[event_scope(row[0]) for row in batch],
+                    *{user_events_scope(row[1]) for row in batch},
+                    *{concert_scope(row[2]) for row in batch if row[2] is not None}
+                )
+        self.stdout.write(self.style.SUCCESS('Fixed %s drifted events' % len(drifted)))
@@ -0,0 +1,248 @@
+import argparse
+import math
+import random
+import string
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.catalog import link_events
+from api.coattendance import rebuild as rebuild_coattendance
+from api.geo import KM_PER_DEGREE, encode, geocode
+from api.models import Attendee, Event
+from api.search import parse_bound
+
+CITIES = (
+    'New York, NY', 'Los Angeles, CA', 'Chicago, IL', 'Houston, TX', 'Phoenix, AZ', 'Philadelphia, PA',
+    'San Antonio, TX', 'San Diego, CA', 'Dallas, TX', 'Austin, TX', 'Nashville, TN', 'Denver, CO',
+    'Seattle, WA', 'Boston, MA', 'Atlanta, GA', 'Miami, FL', 'Portland, OR', 'Las Vegas, NV',
+    'Minneapolis, MN', 'New Orleans, LA', 'Detroit, MI', 'Salt Lake City, UT', 'Kansas City, MO',
+    'Columbus, OH', 'Charlotte, NC', 'San Francisco, CA', 'Toronto, ON', 'London, UK', 'Berlin, DE',
+    'Mexico City, MX',
+)
+VENUE_WORDS = (
+    'Crystal', 'Red Rock', 'Union', 'Majestic', 'Blue Note', 'Paramount', 'Fillmore', 'Orpheum',
+    'Riverside', 'Liberty', 'Empire', 'Starlight', 'Grand', 'Echo', 'Harbor', 'Summit',
+)
+VENUE_KINDS = ('Ballroom', 'Theatre', 'Arena', 'Hall', 'Amphitheatre', 'Stadium', 'Club', 'Pavilion')
+ARTIST_WORDS = (
+    'Midnight', 'Velvet', 'Electric', 'Golden', 'Silver', 'Neon', 'Wild', 'Hollow', 'Paper', 'Glass',
+    'Lunar', 'Crimson', 'Static', 'Honey', 'Iron', 'Quiet',
+)
+ARTIST_NOUNS = (
+    'Foxes', 'Riot', 'Orchard', 'Tides', 'Machines', 'Sisters', 'Parade', 'Coast', 'Hearts', 'Ghosts',
+    'Radio', 'Season', 'Wolves', 'Lanterns', 'Avenue', 'Signal',
+)
+TOURS = ('World Tour', 'Summer Tour', 'Reunion Tour', 'Album Release Show', 'Farewell Tour', 'Live')
+# Shows start in the evening, most of them at 8 pm
+START_HOURS = (18, 19, 20, 21, 22)
+START_HOUR_WEIGHTS = (1, 3, 5, 3, 1)
+BASE62 = string.digits + string.ascii_letters
+# Venues are spread this far around their city's center
+VENUE_SPREAD_KM = 15
+
+
+def zipf_cum_weights(n, exponent):
+    # Cumulative, so random.choices() doesn't add them up on every call
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def moment(value):
+    try:
+        return parse_bound(value).astimezone(timezone.utc)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def attendee_counts(events, users, max_attendees, exponent):
+    """
+    Attendees per event following a power law: the most popular event gets
+    ``max_attendees``, the one ranked r gets ``max_attendees / r**exponent``.
+    """
+    top = min(max_attendees, users)
+    return [int(top / rank ** exponent) for rank in range(1, events + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the configured database with synthetic users, events and a "
+        "power-law attendee distribution for load testing. The output only "
+        "depends on --seed and --now. Everything is created in one transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--events', type=int, default=10000)
+        parser.add_argument(
+            '--max-attendees', type=int, default=100000,
+            help='Attendees of the most popular event, capped at --users.'
+        )
+        parser.add_argument(
+            '--exponent', type=float, default=1.0,
+            help='Power-law exponent of attendees per event. Higher concentrates them on fewer events.'
+        )
+        parser.add_argument('--artists', type=int, help='Distinct artists (default: events / 10).')
+        parser.add_argument('--venues', type=int, help='Distinct venues (default: events / 20).')
+        parser.add_argument('--prefix', default='load', help='Prefix of the usernames and ticketmaster ids.')
+        parser.add_argument('--password', default='load-password', help='Password of every user.')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per bulk_create() or executemany().')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--now', type=moment,
+            help='ISO 8601 date or datetime the event dates are spread around (default: now). '
+                 'Give it to get the same data on any day.'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['events'] < 0:
+            raise CommandError('--users must be at least 1 and --events not negative')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix + '-user-').exists():
+            raise CommandError('Users named %s-user-* already exist, pick another --prefix' % prefix)
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        now = options['now'] or datetime.now(timezone.utc)
+        started = time.perf_counter()
+        with transaction.atomic():
+            user_ids = self.create_users(prefix, options['users'], options['password'], now, batch_size)
+            counts = attendee_counts(options['events'], len(user_ids), options['max_attendees'], options['exponent'])
+            # Popularity isn't related to when or where an event is
+            rng.shuffle(counts)
+            event_ids = self.create_events(rng, prefix, user_ids, counts, options, now, batch_size)
+            attendees = self.create_attendees(rng, user_ids, event_ids, counts, batch_size)
+            inserted = time.perf_counter()
+            # Neither bulk_create nor the raw inserts send the signals that
+            # count co-attendance
+            rebuild_coattendance()
+
+        finished = time.perf_counter()
+        self.stdout.write(
+            'Created %s users, %s events and %s attendees (largest event %s) in %.1f s, '
+            'then counted co-attendance in %.1f s' % (
+                len(user_ids), len(event_ids), attendees, max(counts, default=0),
+                inserted - started, finished - inserted,
+            )
+        )
+
+    def insert(self, model, objects, batch_size):
+        """
+        bulk_create() the instances ``objects`` yields, ``batch_size`` at a
+        time, and return how many there were. Only one batch is built at
+        once.
+        """
+        inserted = 0
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, batch_size))
+            if not batch:
+                return inserted
+            model.objects.bulk_create(batch)
+            inserted += len(batch)
+
+    def insert_rows(self, model, fields, rows, batch_size):
+        """
+        INSERT ``rows``, tuples of database values of ``fields``, with one
+        executemany() per batch and return how many there were. For the
+        users and attendees: at a million rows, building and preparing the
+        instances is most of what bulk_create() would spend.
+        """
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            qn(model._meta.db_table),
+            ', '.join(qn(model._meta.get_field(name).column) for name in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        inserted = 0
+        rows = iter(rows)
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    return inserted
+                cursor.executemany(sql, batch)
+                inserted += len(batch)
+
+    def create_users(self, prefix, count, password, now, batch_size):
+        # One PBKDF2 hash shared by every user instead of one per user
+        password = make_password(password)
+        joined = connection.ops.adapt_datetimefield_value(now)
+        self.insert_rows(
+            User,
+            ('username', 'email', 'password', 'first_name', 'last_name',
+             'is_staff', 'is_active', 'is_superuser', 'date_joined'),
+            (('%s-user-%s' % (prefix, i), '%s-user-%s@example.com' % (prefix, i), password, '', '',
+              False, True, False, joined) for i in range(count)),
+            batch_size,
+        )
+        return list(
+            User.objects.filter(username__startswith=prefix + '-user-').order_by('id').values_list('id', flat=True)
+        )
+
+    def create_events(self, rng, prefix, user_ids, counts, options, now, batch_size):
+        artists = [
+            ('%s %s' % (rng.choice(ARTIST_WORDS), rng.choice(ARTIST_NOUNS)), ''.join(rng.choices(BASE62, k=22)))
+            for _ in range(options['artists'] or max(len(counts) // 10, 1))
+        ]
+        venues = [
+            ('%s %s' % (rng.choice(VENUE_WORDS), rng.choice(VENUE_KINDS)), city) + self.venue_coordinates(rng, city)
+            for city in rng.choices(CITIES, k=options['venues'] or max(len(counts) // 20, 1))
+        ]
+        artist_weights = zipf_cum_weights(len(artists), 1.0)
+        venue_weights = zipf_cum_weights(len(venues), 0.8)
+        # A few users (promoters, venues) own most of the events
+        owner_weights = zipf_cum_weights(len(user_ids), 1.0)
+        # Half a year of past events and a year of upcoming ones
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        def events():
+            for i, count in enumerate(counts):
+                artist, spotify_artist_id = rng.choices(artists, cum_weights=artist_weights)[0]
+                venue, city, latitude, longitude, geohash = rng.choices(venues, cum_weights=venue_weights)[0]
+                date_time = today + timedelta(
+                    days=rng.randint(-182, 365),
+                    hours=rng.choices(START_HOURS, START_HOUR_WEIGHTS)[0],
+                    minutes=rng.choice((0, 0, 30)),
+                )
+                yield Event(
+                    venue_name=venue,
+                    event_name='%s %s' % (artist, rng.choice(TOURS)),
+                    date_time=date_time,
+                    artist=artist,
+                    location=city,
+                    spotify_artist_id=spotify_artist_id,
+                    ticketmaster_event_id='%s-%s-%s' % (prefix, i, ''.join(rng.choices(BASE62, k=12))),
+                    owner_id=rng.choices(user_ids, cum_weights=owner_weights)[0],
+                    attendee_count=count,
+                    latitude=latitude,
+                    longitude=longitude,
+                    geohash=geohash,
+                )
+
+        self.insert(Event, events(), batch_size)
+        # bulk_create doesn't send the pre_save that links events to concerts
+        link_events(Event.objects.filter(ticketmaster_event_id__startswith=prefix + '-'), batch_size=batch_size)
+        return list(
+            Event.objects.filter(ticketmaster_event_id__startswith=prefix + '-')
+            .order_by('id').values_list('id', flat=True)
+        )
+
+    def venue_coordinates(self, rng, city):
+        latitude, longitude = geocode(city)
+        latitude += rng.uniform(-1, 1) * VENUE_SPREAD_KM / KM_PER_DEGREE
+        longitude += rng.uniform(-1, 1) * VENUE_SPREAD_KM / (KM_PER_DEGREE * math.cos(math.radians(latitude)))
+        return latitude, longitude, encode(latitude, longitude)
+
+    def create_attendees(self, rng, user_ids, event_ids, counts, batch_size):
+        def attendees():
+            for event_id, count in zip(event_ids, counts):
+                # In (event, user) order, so the unique index is appended to
+                for user_id in sorted(rng.sample(user_ids, count)):
+                    yield event_id, user_id
+
+        return self.insert_rows(Attendee, ('event', 'user'), attendees(), batch_size)
@@ -0,0 +1,276 @@
+"""
+Per-route request metrics in the Prometheus text format.
+
+MetricsMiddleware records, per URL name and method: a latency histogram, a
+histogram of the number of queries each request ran, time spent in the
+database, response bytes and a count per status code. Queries are counted by
+an execute wrapper installed once on every database connection (see
+api.signals). The wrapper adds to the current request's counters through a
+context variable, so recording a request costs a few dictionary and list
+updates under a lock.
+
+Every worker process keeps its own series. When API_METRICS_DIR is set, a
+background thread writes them to a snapshot file per process every
+API_METRICS_FLUSH_INTERVAL seconds, and /metrics adds up the snapshots of
+every worker that has written one. gunicorn.conf.py sets API_METRICS_DIR and
+empties it when the server starts.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# Layout of a series: totals, then one slot per latency bucket and one per
+# query bucket, each with a final slot for +Inf.
+COUNT, LATENCY_SUM, QUERIES_SUM, DB_SECONDS, RESPONSE_BYTES = range(5)
+LATENCY_START = 5
+QUERIES_START = LATENCY_START + len(LATENCY_BUCKETS) + 1
+SERIES_SIZE = QUERIES_START + len(QUERY_BUCKETS) + 1
+
+UNMATCHED = 'unmatched'
+
+# The method is sent by the client: any other value shares one series, so a
+# client can't add series without bound
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+OTHER_METHOD = 'other'
+
+_lock = threading.Lock()
+_series = {}
+_statuses = {}
+_flusher = None
+
+# [queries, seconds] of the request being handled, None outside requests
+_request_db = ContextVar('api_metrics_request_db', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper adding each query and its duration to the current
+    request's counters.
+    """
+    counters = _request_db.get()
+    if counters is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counters[0] += 1
+        counters[1] += time.perf_counter() - start
+
+
+def install_query_counter(connection):
+    # connection_created fires again on every reconnect of the same wrapper
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def record(route, method, status, seconds, queries, db_seconds, response_bytes):
+    key = (route, method)
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = [0] * SERIES_SIZE
+        series[COUNT] += 1
+        series[LATENCY_SUM] += seconds
+        series[QUERIES_SUM] += queries
+        series[DB_SECONDS] += db_seconds
+        series[RESPONSE_BYTES] += response_bytes
+        series[LATENCY_START + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        series[QUERIES_START + bisect_left(QUERY_BUCKETS, queries)] += 1
+        status_key = (route, method, status)
+        _statuses[status_key] = _statuses.get(status_key, 0) + 1
+
+
+def snapshot():
+    """
+    Return this process's series as JSON-serializable data.
+    """
+    with _lock:
+        return {
+            'series': [[route, method, list(values)] for (route, method), values in _series.items()],
+            'statuses': [[route, method, status, count] for (route, method, status), count in _statuses.items()],
+        }
+
+
+def reset():
+    with _lock:
+        _series.clear()
+        _statuses.clear()
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, 'metrics-%s.json' % pid)
+
+
+def write_snapshot():
+    directory = settings.API_METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, os.getpid())
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.API_METRICS_FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+
+def _start_flusher():
+    # Started lazily in each worker: threads don't survive gunicorn's fork
+    # of a preloaded app.
+    global _flusher
+    if _flusher is None or _flusher[0] != os.getpid():
+        thread = threading.Thread(target=_flush_forever, name='api-metrics-flush', daemon=True)
+        _flusher = (os.getpid(), thread)
+        thread.start()
+
+
+def collect():
+    """
+    Merge this process's series with the snapshots the other workers wrote.
+    """
+    snapshots = [snapshot()]
+    directory = settings.API_METRICS_DIR
+    if directory and os.path.isdir(directory):
+        own = _snapshot_path(directory, os.getpid())
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if path == own or not name.endswith('.json'):
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    series, statuses = {}, {}
+    for data in snapshots:
+        for route, method, values in data['series']:
+            merged = series.setdefault((route, method), [0] * SERIES_SIZE)
+            for index, value in enumerate(values):
+                merged[index] += value
+        for route, method, status, count in data['statuses']:
+            key = (route, method, status)
+            statuses[key] = statuses.get(key, 0) + count
+    return series, statuses
+
+
+def _escape(value):
+    # Label values in the text format escape backslash, quote and newline
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(route, method, **extra):
+    labels = [('route', route), ('method', method)] + list(extra.items())
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _histogram(lines, name, buckets, start, series, total):
+    for (route, method), values in sorted(series.items()):
+        cumulative = 0
+        for index, bound in enumerate(buckets):
+            cumulative += values[start + index]
+            lines.append('%s_bucket%s %s' % (name, _labels(route, method, le=bound), cumulative))
+        lines.append('%s_bucket%s %s' % (name, _labels(route, method, le='+Inf'), values[COUNT]))
+        lines.append('%s_sum%s %s' % (name, _labels(route, method), values[total]))
+        lines.append('%s_count%s %s' % (name, _labels(route, method), values[COUNT]))
+
+
+def render():
+    series, statuses = collect()
+    lines = [
+        '# HELP api_requests_total Requests handled, by URL name, method and status.',
+        '# TYPE api_requests_total counter',
+    ]
+    for (route, method, status), count in sorted(statuses.items()):
+        lines.append('api_requests_total%s %s' % (_labels(route, method, status=status), count))
+
+    lines += [
+        '# HELP api_request_duration_seconds Time to the response headers, by URL name and method.',
+        '# TYPE api_request_duration_seconds histogram',
+    ]
+    _histogram(lines, 'api_request_duration_seconds', LATENCY_BUCKETS, LATENCY_START, series, LATENCY_SUM)
+
+    lines += [
+        '# HELP api_request_queries Database queries per request, by URL name and method.',
+        '# TYPE api_request_queries histogram',
+    ]
+    _histogram(lines, 'api_request_queries', QUERY_BUCKETS, QUERIES_START, series, QUERIES_SUM)
+
+    for name, index, help_text in (
+        ('api_db_duration_seconds_total', DB_SECONDS, 'Time spent executing database queries.'),
+        ('api_response_bytes_total', RESPONSE_BYTES, 'Response body bytes, streamed responses excluded.'),
+    ):
+        lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+        for (route, method), values in sorted(series.items()):
+            lines.append('%s%s %s' % (name, _labels(route, method), values[index]))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """
+    Record every request. Goes first in MIDDLEWARE so the time of the rest of
+    the chain is included. Works in both sync and async stacks without a
+    thread switch.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counters = [0, 0.0]
+        token = _request_db.set(counters)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_db.reset(token)
+        self.finish(request, response, time.perf_counter() - start, counters)
+        return response
+
+    async def __acall__(self, request):
+        counters = [0, 0.0]
+        token = _request_db.set(counters)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_db.reset(token)
+        self.finish(request, response, time.perf_counter() - start, counters)
+        return response
+
+    def finish(self, request, response, seconds, counters):
+        match = request.resolver_match
+        record(
+            match.view_name if match is not None and match.view_name else UNMATCHED,
+            request.method if request.method in METHODS else OTHER_METHOD,
+            response.status_code,
+            seconds,
+            counters[0],
+            counters[1],
+            0 if response.streaming else len(response.content),
+        )
+        if settings.API_METRICS_DIR:
+            _start_flusher()
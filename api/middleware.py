@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from .tokens import InvalidToken, TokenUser, bearer_token, read_token
+
+
+class TokenAuthenticationMiddleware(MiddlewareMixin):
+    """
+    Authenticate ``Authorization: Bearer <token>`` requests from the token
+    alone when API_AUTH_MODE is 'token'. ``request.user`` becomes a
+    ``TokenUser``, so neither the session nor the user row is read.
+    """
+
+    def __init__(self, get_response):
+        if settings.API_AUTH_MODE != 'token':
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        if not hasattr(request, 'user'):
+            # Without AuthenticationMiddleware (the api settings profile in
+            # token mode) nobody else sets it.
+            request.user = AnonymousUser()
+        token = bearer_token(request)
+        if token is None:
+            return None
+        try:
+            claims = read_token(token)
+        except InvalidToken as e:
+            return JsonResponse({'error': str(e)}, status=401)
+        request.user = TokenUser(claims)
+        request.token_claims = claims
+        return None
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.15 on 2026-10-18 07:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_attendees(apps, schema_editor):
+    Attendee = apps.get_model('api', 'Attendee')
+    Event = apps.get_model('api', 'Event')
+    counts = Attendee.objects.filter(event=OuterRef('pk')).order_by().values('event').annotate(count=Count('pk')).values('count')
+    Event.objects.update(attendee_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_event_last_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='attendee_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_attendees, migrations.RunPython.noop),
+    ]
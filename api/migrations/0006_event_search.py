@@ -0,0 +1,70 @@
+from django.db import OperationalError, migrations
+
+# External content table over api_event: the text isn't stored twice, only
+# the index. The prefix indexes make 2 and 3 character prefix queries cheap.
+CREATE_TABLE = """
+CREATE VIRTUAL TABLE api_event_fts USING fts5(
+    artist, event_name, venue_name, location,
+    content='api_event', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)
+"""
+
+# Triggers rather than signals, so bulk_create() and raw inserts are indexed
+# too. The update trigger only fires when an indexed column changes, not on
+# the attendee_count and last_modified updates of every join and leave.
+CREATE_TRIGGERS = (
+    """
+    CREATE TRIGGER api_event_fts_insert AFTER INSERT ON api_event BEGIN
+        INSERT INTO api_event_fts (rowid, artist, event_name, venue_name, location)
+        VALUES (new.id, new.artist, new.event_name, new.venue_name, new.location);
+    END
+    """,
+    """
+    CREATE TRIGGER api_event_fts_delete AFTER DELETE ON api_event BEGIN
+        INSERT INTO api_event_fts (api_event_fts, rowid, artist, event_name, venue_name, location)
+        VALUES ('delete', old.id, old.artist, old.event_name, old.venue_name, old.location);
+    END
+    """,
+    """
+    CREATE TRIGGER api_event_fts_update AFTER UPDATE OF artist, event_name, venue_name, location ON api_event BEGIN
+        INSERT INTO api_event_fts (api_event_fts, rowid, artist, event_name, venue_name, location)
+        VALUES ('delete', old.id, old.artist, old.event_name, old.venue_name, old.location);
+        INSERT INTO api_event_fts (rowid, artist, event_name, venue_name, location)
+        VALUES (new.id, new.artist, new.event_name, new.venue_name, new.location);
+    END
+    """,
+)
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_TABLE)
+    except OperationalError:
+        # SQLite built without FTS5: api/search.py falls back to substring
+        # matching.
+        return
+    for statement in CREATE_TRIGGERS:
+        schema_editor.execute(statement)
+    schema_editor.execute("INSERT INTO api_event_fts (api_event_fts) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for trigger in ('insert', 'delete', 'update'):
+        schema_editor.execute('DROP TRIGGER IF EXISTS api_event_fts_%s' % trigger)
+    schema_editor.execute('DROP TABLE IF EXISTS api_event_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_event_attendee_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
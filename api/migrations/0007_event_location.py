@@ -0,0 +1,103 @@
+# Generated by Django 4.2.15 on 2026-10-18 08:04
+
+import csv
+import os
+import re
+
+from django.db import migrations, models
+
+# A copy of api.geo's geocoding as it was when this migration was written,
+# so later changes to that module can't change what the migration does.
+# Only the gazetteer is read from the app: a fresh database places what
+# today's file knows, and without it the events are left for the
+# geocode_events command.
+GAZETTEER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'gazetteer.csv')
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+
+
+def normalize_location(location):
+    return re.sub(r'\s*,\s*', ', ', re.sub(r'\s+', ' ', location.strip().lower()))
+
+
+def read_gazetteer():
+    if not os.path.exists(GAZETTEER):
+        return {}
+    with open(GAZETTEER, newline='', encoding='utf-8') as f:
+        return {
+            normalize_location(row['location']): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(f)
+        }
+
+
+def geocode(places, location):
+    if not location:
+        return None
+    parts = normalize_location(location).split(', ')
+    for length in range(len(parts), 1, -1):
+        coordinates = places.get(', '.join(parts[:length]))
+        if coordinates is not None:
+            return coordinates
+    return None
+
+
+def encode(latitude, longitude):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < GEOHASH_PRECISION:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geocode_events(apps, schema_editor):
+    # One UPDATE per distinct location the gazetteer knows
+    places = read_gazetteer()
+    events = apps.get_model('api', 'Event').objects.filter(latitude__isnull=True)
+    for location in list(events.order_by().values_list('location', flat=True).distinct()):
+        coordinates = geocode(places, location)
+        if coordinates is not None:
+            events.filter(location=location).update(
+                latitude=coordinates[0], longitude=coordinates[1], geohash=encode(*coordinates),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_event_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['geohash', 'date_time', 'latitude', 'longitude'], name='event_geohash_idx'),
+        ),
+        migrations.RunPython(geocode_events, migrations.RunPython.noop),
+    ]
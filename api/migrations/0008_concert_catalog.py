@@ -0,0 +1,86 @@
+# Generated by Django 4.2.15 on 2026-10-18 08:14
+
+from django.db import connection, migrations, models, transaction
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+# A copy of api.catalog.link_events() as it was when this migration was
+# written, so later changes to that module can't change what it does
+CONCERT_FIELDS = (
+    'ticketmaster_event_id', 'venue_name', 'event_name', 'date_time',
+    'artist', 'location', 'spotify_artist_id',
+)
+BATCH_SIZE = 1000
+
+
+def link_concerts(apps, schema_editor):
+    # One concert per ticketmaster_event_id, from the earliest of its events
+    Event = apps.get_model('api', 'Event')
+    Concert = apps.get_model('api', 'Concert')
+    qn = connection.ops.quote_name
+    insert = (
+        'INSERT INTO {concert} ({columns}) SELECT {event_columns} FROM {event} WHERE {id} IN ('
+        'SELECT MIN({id}) FROM {event} WHERE {tm} > %s AND {tm} <= %s GROUP BY {tm}'
+        ') ON CONFLICT ({concert_tm}) DO NOTHING'
+    ).format(
+        concert=qn(Concert._meta.db_table),
+        columns=', '.join(qn(Concert._meta.get_field(name).column) for name in CONCERT_FIELDS),
+        event_columns=', '.join(qn(Event._meta.get_field(name).column) for name in CONCERT_FIELDS),
+        event=qn(Event._meta.db_table),
+        id=qn(Event._meta.pk.column),
+        tm=qn(Event._meta.get_field('ticketmaster_event_id').column),
+        concert_tm=qn(Concert._meta.get_field('ticketmaster_event_id').column),
+    )
+    events = Event.objects.all()
+    last = ''
+    while True:
+        # Walks the ticketmaster_event_id index, starting after '' skips
+        # the events that have none
+        keys = list(
+            events.filter(ticketmaster_event_id__gt=last).order_by('ticketmaster_event_id')
+            .values_list('ticketmaster_event_id', flat=True).distinct()[:BATCH_SIZE]
+        )
+        if not keys:
+            return
+        shows = {'ticketmaster_event_id__gt': last, 'ticketmaster_event_id__lte': keys[-1]}
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(insert, [last, keys[-1]])
+            events.filter(concert__isnull=True, **shows).update(concert=Subquery(
+                Concert.objects.filter(ticketmaster_event_id=OuterRef('ticketmaster_event_id')).values('id')[:1]
+            ))
+        last = keys[-1]
+
+
+class Migration(migrations.Migration):
+    # Each batch of link_concerts() commits on its own, so a large table
+    # isn't write-locked for the whole backfill. The schema changes commit
+    # too: a run that fails part way leaves api_concert and
+    # api_event.concert_id behind, to be dropped before migrating again.
+    atomic = False
+
+    dependencies = [
+        ('api', '0007_event_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Concert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticketmaster_event_id', models.CharField(max_length=100, unique=True)),
+                ('venue_name', models.CharField(max_length=100)),
+                ('event_name', models.CharField(max_length=100)),
+                ('date_time', models.DateTimeField()),
+                ('artist', models.CharField(max_length=100)),
+                ('location', models.CharField(max_length=100)),
+                ('spotify_artist_id', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='concert',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='api.concert'),
+        ),
+        migrations.RunPython(link_concerts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.15 on 2026-10-18 08:29
+
+from django.db import connection, migrations, models
+import django.db.models.deletion
+
+# A copy of api.coattendance.rebuild() as it was when this migration was
+# written, so later changes to that module can't change what it does
+BATCH_SIZE = 1000
+
+
+def count_pairs(apps, schema_editor):
+    # The pairs of BATCH_SIZE events at a time, aggregated in the database
+    Attendee = apps.get_model('api', 'Attendee')
+    CoAttendance = apps.get_model('api', 'CoAttendance')
+    qn = connection.ops.quote_name
+    sql = (
+        'INSERT INTO {table} ({event_id}, {other_id}, {shared_count}) '
+        'SELECT a.{attendee_event_id}, b.{attendee_event_id}, COUNT(*) '
+        'FROM {attendee} a JOIN {attendee} b '
+        'ON b.{attendee_user_id} = a.{attendee_user_id} AND b.{attendee_event_id} <> a.{attendee_event_id} '
+        'WHERE a.{attendee_event_id} > %s AND a.{attendee_event_id} <= %s '
+        'GROUP BY a.{attendee_event_id}, b.{attendee_event_id}'
+    ).format(
+        table=qn(CoAttendance._meta.db_table),
+        event_id=qn(CoAttendance._meta.get_field('event').column),
+        other_id=qn(CoAttendance._meta.get_field('other').column),
+        shared_count=qn(CoAttendance._meta.get_field('shared_count').column),
+        attendee=qn(Attendee._meta.db_table),
+        attendee_event_id=qn(Attendee._meta.get_field('event').column),
+        attendee_user_id=qn(Attendee._meta.get_field('user').column),
+    )
+    last = 0
+    with connection.cursor() as cursor:
+        while True:
+            event_ids = list(
+                Attendee.objects.filter(event_id__gt=last).order_by('event_id')
+                .values_list('event_id', flat=True).distinct()[:BATCH_SIZE]
+            )
+            if not event_ids:
+                return
+            cursor.execute(sql, [last, event_ids[-1]])
+            last = event_ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_concert_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared_count', models.IntegerField()),
+                ('event', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='co_attendance', to='api.event')),
+                ('other', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.event')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['event', '-shared_count', 'other'], name='coattendance_top_idx')],
+                'unique_together': {('event', 'other')},
+            },
+        ),
+        migrations.RunPython(count_pairs, migrations.RunPython.noop),
+    ]
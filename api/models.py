@@ -2,6 +2,20 @@ from django.db import models
 from django.contrib.auth.models import User
 
 # Create your models here.
+class Concert(models.Model):
+    # One row per show, shared by every user's event of it. Created from the
+    # first event saved with its ticketmaster_event_id, see api/catalog.py.
+    ticketmaster_event_id = models.CharField(max_length=100, unique=True)
+    venue_name = models.CharField(max_length=100)
+    event_name = models.CharField(max_length=100)
+    date_time = models.DateTimeField()
+    artist = models.CharField(max_length=100)
+    location = models.CharField(max_length=100)
+    spotify_artist_id = models.CharField(max_length=100)
+
+    def __str__(self):
+        return f"{self.artist} at {self.venue_name} on {self.date_time}"
+
 class Event(models.Model):
     venue_name = models.CharField(max_length=100)
     event_name = models.CharField(max_length=100)
@@ -10,17 +24,68 @@ class Event(models.Model):
     location = models.CharField(max_length=100)
     spotify_artist_id = models.CharField(max_length=100)
     ticketmaster_event_id = models.CharField(max_length=100)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='event_owner')
+    # Indexed through the leading column of event_owner_date_idx
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='event_owner', db_index=False)
+    # Both maintained by api/attendance.py whenever attendees change
+    last_modified = models.DateTimeField(auto_now=True)
+    attendee_count = models.IntegerField(default=0)
+    # Set from location when not given. geohash is derived from both by a
+    # pre_save receiver, see api/geo.py.
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, null=True, blank=True, editable=False)
+    # The shared show this event is a user's copy of. The columns above are
+    # the owner's own and are never rewritten from the concert.
+    concert = models.ForeignKey(Concert, on_delete=models.SET_NULL, null=True, blank=True, related_name='events')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'date_time'], name='event_owner_date_idx'),
+            models.Index(fields=['owner', 'last_modified'], name='event_owner_modified_idx'),
+            models.Index(fields=['ticketmaster_event_id'], name='event_tm_event_id_idx'),
+            models.Index(fields=['spotify_artist_id'], name='event_spotify_artist_id_idx'),
+            models.Index(fields=['artist'], name='event_artist_idx'),
+            # Covers the nearby candidate scan, no table reads
+            models.Index(fields=['geohash', 'date_time', 'latitude', 'longitude'], name='event_geohash_idx'),
+        ]
 
     def __str__(self):
         return f"{self.owner} created event for {self.artist} at {self.venue_name} on {self.date_time}"
 
 class Attendee(models.Model):
-    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='attendees')
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='events_attending')
+    # Both foreign keys are covered by the leading column of a composite
+    # index, so the single-column indexes would only slow down writes.
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='attendees', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='events_attending', db_index=False)
 
     class Meta:
         unique_together = ('event', 'user')
+        indexes = [
+            models.Index(fields=['user', 'event'], name='attendee_user_event_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} attending {self.event.event_name}"
+
+class CoAttendance(models.Model):
+    """
+    How many users attend both ``event`` and ``other``. Both directions of
+    every pair are stored, so the events related to one are a single range
+    of coattendance_top_idx, best first. Kept up to date by api.attendance,
+    rebuilt by the rebuild_coattendance command.
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='co_attendance', db_index=False)
+    # Deleting an event removes the rows pointing at it through the
+    # (event, other) index, see api.signals, instead of an index on other
+    # that every write would have to maintain.
+    other = models.ForeignKey(Event, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, related_name='+')
+    shared_count = models.IntegerField()
+
+    class Meta:
+        unique_together = ('event', 'other')
+        indexes = [
+            models.Index(fields=['event', '-shared_count', 'other'], name='coattendance_top_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} attending {self.event.concert.title}"
\ No newline at end of file
+        return f"{self.shared_count} attending both {self.event_id} and {self.other_id}"
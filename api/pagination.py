@@ -0,0 +1,114 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+Pages are fetched with a range condition on the ordering columns instead of
+an OFFSET, so every page is the same indexed range scan no matter how deep
+the client goes. Cursors are opaque to clients: url-safe base64 of the
+ordering values of the last row on the previous page.
+"""
+
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def get_limit(request):
+    raw = request.GET.get('limit')
+    if raw is None:
+        return settings.API_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise InvalidPage('limit must be an integer')
+    if limit < 1:
+        raise InvalidPage('limit must be a positive integer')
+    return min(limit, settings.API_MAX_PAGE_SIZE)
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidPage('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidPage('Invalid cursor')
+    try:
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(ordering, values)]
+    except (FieldDoesNotExist, ValidationError, TypeError):
+        raise InvalidPage('Invalid cursor')
+
+
+def _after(ordering, values):
+    # (a, b) > (x, y) written as a >= x AND (a > x OR b > y) so the leading
+    # column stays a plain range condition the index can seek on.
+    field, value = ordering[0], values[0]
+    if len(ordering) == 1:
+        return Q(**{field + '__gt': value})
+    return Q(**{field + '__gte': value}) & (
+        Q(**{field + '__gt': value}) | _after(ordering[1:], values[1:])
+    )
+
+
+def _page_queryset(queryset, ordering, cursor):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_after(ordering, decode_cursor(cursor, queryset.model, ordering)))
+    return queryset
+
+
+def _page(rows, ordering, limit, key):
+    if key is None:
+        key = lambda row: [getattr(row, field) for field in ordering]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key(rows[-1]))
+    return rows, next_cursor
+
+
+def paginate(queryset, ordering, cursor, limit, key=None):
+    """
+    Return ``(rows, next_cursor)`` for the page after ``cursor``.
+
+    ``ordering`` must be unique per row (end it with a primary key). ``key``
+    extracts the ordering values from a row and defaults to attribute access,
+    pass one when paginating a ``values_list`` queryset.
+    """
+    queryset = _page_queryset(queryset, ordering, cursor)
+    return _page(list(queryset[:limit + 1]), ordering, limit, key)
+
+
+def paginate_union(queryset, branches, ordering, cursor, limit, key=None):
+    """
+    ``paginate()`` over the rows of ``queryset`` that are in any of
+    ``branches``, querysets of the same model. Each branch is paged on its
+    own in a subquery, so it stays an indexed scan of at most ``limit + 1``
+    rows instead of the database sorting everything an OR of them matches.
+    """
+    in_any = Q()
+    for branch in branches:
+        in_any |= Q(pk__in=_page_queryset(branch, ordering, cursor).values('pk')[:limit + 1])
+    return paginate(queryset.filter(in_any), ordering, cursor, limit, key)
+
+
+async def apaginate(queryset, ordering, cursor, limit, key=None):
+    """
+    Async version of ``paginate()``.
+    """
+    queryset = _page_queryset(queryset, ordering, cursor)
+    return _page([row async for row in queryset[:limit + 1]], ordering, limit, key)
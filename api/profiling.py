@@ -0,0 +1,236 @@
+"""
+Opt-in request profiling and slow-query capture.
+
+ProfilingMiddleware profiles a request that sends a valid ``X-Profile``
+header (``manage.py profile_token`` issues one) or is picked at random at
+API_PROFILE_SAMPLE_RATE. The request runs under cProfile. Every query on it
+that takes at least API_SLOW_QUERY_MS is kept and explained once the
+response is ready. Each capture is written to API_PROFILE_DIR as a
+``<capture>.prof`` pstats file and a ``<capture>.json`` with the request and
+its slow queries. Only the newest API_PROFILE_MAX_CAPTURES are kept.
+``manage.py profile_report`` summarizes them.
+
+Requests that aren't profiled pay for a random number when sampling is on,
+and one context variable lookup per query.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.db import DatabaseError, connections
+
+SALT = 'api.profiling'
+HEADER = 'HTTP_X_PROFILE'
+
+# Statements worth asking the database for a plan of
+STATEMENTS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+# Only one profiler can be active at a time: a request that would be profiled
+# while another one is just runs normally.
+_profiling = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+# Slow queries of the request being profiled, None otherwise
+_slow_queries = ContextVar('api_profiling_slow_queries', default=None)
+
+
+def issue_profile_token():
+    return signing.dumps('profile', salt=SALT)
+
+
+def valid_profile_token(value):
+    try:
+        return signing.loads(value, salt=SALT, max_age=settings.API_PROFILE_TOKEN_MAX_AGE) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def profile_reason(request):
+    """
+    Return why ``request`` should be profiled ('header' or 'sample'), or
+    None.
+    """
+    value = request.META.get(HEADER)
+    if value is not None and valid_profile_token(value):
+        return 'header'
+    rate = settings.API_PROFILE_SAMPLE_RATE
+    if rate and random.random() < rate:
+        return 'sample'
+    return None
+
+
+def capture_slow_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper keeping the queries of a profiled request that take at
+    least API_SLOW_QUERY_MS.
+    """
+    queries = _slow_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        if seconds * 1000 >= settings.API_SLOW_QUERY_MS:
+            queries.append((context['connection'].alias, sql, params, many, seconds))
+
+
+def install_slow_query_capture(connection):
+    if capture_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture_slow_queries)
+
+
+def explain(connection, sql, params=None):
+    """
+    Yield the lines of the database's plan for ``sql``.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            depth = {0: -1}
+            for node_id, parent, _, detail in cursor.fetchall():
+                depth[node_id] = depth.get(parent, -1) + 1
+                yield '  ' * depth[node_id] + detail
+        else:
+            cursor.execute('EXPLAIN ' + sql, params)
+            for row in cursor.fetchall():
+                yield ' '.join(str(column) for column in row)
+
+
+def _plan(alias, sql, params, many):
+    if not sql.lstrip().upper().startswith(STATEMENTS):
+        return []
+    if many:
+        params = next(iter(params), None)
+    try:
+        return list(explain(connections[alias], sql, params))
+    except DatabaseError as e:
+        return ['EXPLAIN failed: %s' % e]
+
+
+def rotate(directory, keep):
+    """
+    Delete all but the newest ``keep`` captures in ``directory``.
+    """
+    # Capture names start with their UTC timestamp
+    captures = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    for capture in captures[:max(len(captures) - keep, 0)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, capture + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def save_capture(request, response, reason, started_at, seconds, profiler, slow_queries):
+    """
+    Write the capture of a profiled request and return its name, or None if
+    it couldn't be written. The response goes out either way.
+    """
+    try:
+        return _write_capture(request, response, reason, started_at, seconds, profiler, slow_queries)
+    except OSError:
+        logger.exception('Writing the profile capture of %s %s failed', request.method, request.path)
+        return None
+
+
+def _write_capture(request, response, reason, started_at, seconds, profiler, slow_queries):
+    match = request.resolver_match
+    route = match.view_name if match is not None and match.view_name else 'unmatched'
+    directory = settings.API_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = '%s-%s-%s' % (started_at.strftime('%Y%m%dT%H%M%S.%fZ'), os.getpid(), route)
+
+    profiler.dump_stats(os.path.join(directory, name + '.prof'))
+    capture = {
+        'route': route,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'reason': reason,
+        'started_at': started_at.isoformat(),
+        'duration_ms': seconds * 1000,
+        'slow_queries': [
+            {
+                'alias': alias,
+                'sql': sql,
+                'params': params,
+                'duration_ms': query_seconds * 1000,
+                'plan': _plan(alias, sql, params, many),
+            } for alias, sql, params, many, query_seconds in slow_queries
+        ],
+    }
+    with open(os.path.join(directory, name + '.json'), 'w') as f:
+        json.dump(capture, f, indent=2, default=str)
+    rotate(directory, settings.API_PROFILE_MAX_CAPTURES)
+    return name
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests ``profile_reason()`` picks. Goes first in
+    MIDDLEWARE so the whole chain is profiled and writing the capture isn't
+    counted by the metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        reason = profile_reason(request)
+        if reason is None or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+        slow_queries = []
+        token = _slow_queries.set(slow_queries)
+        profiler = cProfile.Profile()
+        started_at, start = datetime.now(timezone.utc), time.perf_counter()
+        try:
+            response = profiler.runcall(self.get_response, request)
+        finally:
+            _slow_queries.reset(token)
+            _profiling.release()
+        save_capture(request, response, reason, started_at, time.perf_counter() - start, profiler, slow_queries)
+        return response
+
+    async def __acall__(self, request):
+        reason = profile_reason(request)
+        if reason is None or not _profiling.acquire(blocking=False):
+            return await self.get_response(request)
+        # Only the event loop's thread is profiled, which includes other
+        # requests it serves meanwhile. Sync views and ORM calls run on other
+        # threads and show up as time spent waiting for them. Slow queries
+        # are captured wherever they run.
+        slow_queries = []
+        token = _slow_queries.set(slow_queries)
+        profiler = cProfile.Profile()
+        started_at, start = datetime.now(timezone.utc), time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            _slow_queries.reset(token)
+            _profiling.release()
+        await sync_to_async(save_capture)(
+            request, response, reason, started_at, time.perf_counter() - start, profiler, slow_queries
+        )
+        return response
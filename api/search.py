@@ -0,0 +1,131 @@
+"""
+Event search over artist, event name, venue and location.
+
+On SQLite the api_event_fts FTS5 table indexes those columns. Triggers from
+migration 0006 keep it in sync with api_event. Every word of the query
+matches as a prefix (single letters only as whole words: there's no prefix
+index for them). Results are ranked by BM25, where an artist match weighs
+most. Scoring costs about a microsecond per match, so only the newest
+API_SEARCH_CANDIDATES matches are ranked. Other backends, and SQLite builds
+without FTS5, fall back to case-insensitive substring matching of every
+word, earliest events first.
+
+Migrations that make Django rebuild api_event on SQLite (most field
+alterations) drop its triggers. They have to create them again.
+"""
+
+import re
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Event
+
+FTS_TABLE = 'api_event_fts'
+FTS_COLUMNS = ('artist', 'event_name', 'venue_name', 'location')
+# bm25() weight of each of FTS_COLUMNS
+BM25_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+MAX_TERMS = 8
+
+_fts_tables = {}
+
+
+def query_terms(q):
+    """
+    The words of ``q``, lowercased. Anything else is dropped, so user input
+    never reaches FTS5 as query syntax.
+    """
+    return re.findall(r'\w+', q.lower())[:MAX_TERMS]
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a ``from``/``to`` parameter, an ISO 8601 date or datetime. A date
+    as ``to`` includes that whole day. Raise ValueError if it's neither.
+    """
+    # Dates first: parse_datetime() also accepts them on Python 3.11+
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time())
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError('%r is not an ISO 8601 date or datetime' % value)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def fts_available():
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _fts_tables:
+        _fts_tables[key] = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _fts_tables[key]
+
+
+def match_expression(terms):
+    return ' '.join('"%s"*' % term if len(term) > 1 else '"%s"' % term for term in terms)
+
+
+def _fts_ids(terms, owner_id, start, end, limit):
+    sql = [
+        'SELECT e.id, e.date_time, bm25({fts}, {weights}) AS score'
+        ' FROM {fts} JOIN {event} e ON e.id = {fts}.rowid WHERE {fts} MATCH %s'.format(
+            fts=FTS_TABLE,
+            event=Event._meta.db_table,
+            weights=', '.join(str(weight) for weight in BM25_WEIGHTS),
+        )
+    ]
+    params = [match_expression(terms)]
+    if owner_id is not None:
+        sql.append('AND e.owner_id = %s')
+        params.append(owner_id)
+    if start is not None:
+        sql.append('AND e.date_time >= %s')
+        params.append(connection.ops.adapt_datetimefield_value(start))
+    if end is not None:
+        sql.append('AND e.date_time < %s')
+        params.append(connection.ops.adapt_datetimefield_value(end))
+    # FTS5 walks the matches newest first and bm25() is only evaluated for
+    # the candidates this LIMIT lets through
+    sql.append('ORDER BY {fts}.rowid DESC LIMIT %s'.format(fts=FTS_TABLE))
+    params.append(max(settings.API_SEARCH_CANDIDATES, limit))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT id FROM (%s) ORDER BY score, date_time, id LIMIT %%s' % ' '.join(sql),
+            params + [limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_ids(terms, owner_id, start, end, limit):
+    events = Event.objects.all()
+    for term in terms:
+        any_column = Q()
+        for column in FTS_COLUMNS:
+            any_column |= Q(**{column + '__icontains': term})
+        events = events.filter(any_column)
+    if owner_id is not None:
+        events = events.filter(owner_id=owner_id)
+    if start is not None:
+        events = events.filter(date_time__gte=start)
+    if end is not None:
+        events = events.filter(date_time__lt=end)
+    return list(events.order_by('date_time', 'id').values_list('id', flat=True)[:limit])
+
+
+def search_event_ids(terms, owner_id=None, start=None, end=None, limit=20):
+    """
+    Return the ids of the best ``limit`` events matching every one of
+    ``terms``, best first. ``start`` and ``end`` bound ``date_time`` (end
+    excluded).
+    """
+    if not terms:
+        return []
+    search = _fts_ids if fts_available() else _fallback_ids
+    return search(terms, owner_id, start, end, limit)
@@ -0,0 +1,108 @@
+from threading import local
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .attendance import apply_attendance_changes
+from .cache import concert_scope, event_scope, invalidate, user_events_scope
+from .catalog import concert_for
+from .coattendance import forget_event, record_joins, record_leaves
+from .geo import locate
+from .metrics import install_query_counter
+from .profiling import install_slow_query_capture
+from .models import Attendee, Event
+
+
+@receiver(pre_save, sender=Event)
+def locate_event(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'latitude', 'longitude', 'location'} & set(update_fields):
+        return
+    instance.latitude, instance.longitude, instance.geohash = locate(
+        instance.latitude, instance.longitude, instance.location
+    )
+
+
+@receiver(pre_save, sender=Event)
+def link_concert(sender, instance, update_fields=None, **kwargs):
+    if instance.concert_id is None and update_fields is None:
+        instance.concert_id = concert_for(instance)
+
+
+@receiver(pre_delete, sender=Event)
+def event_deleting(sender, instance, **kwargs):
+    forget_event(instance.id)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, instance, **kwargs):
+    scopes = [event_scope(instance.id), user_events_scope(instance.owner_id)]
+    if instance.concert_id is not None:
+        scopes.append(concert_scope(instance.concert_id))
+    invalidate(*scopes)
+
+
+# The API's own attendance writes go through api.attendance and don't send
+# these; the receivers keep ORM writes (admin, shell, tests) consistent.
+
+@receiver(post_save, sender=Attendee)
+def attendee_saved(sender, instance, created, **kwargs):
+    joined = [(instance.user_id, instance.event_id)] if created else []
+    record_joins(joined)
+    apply_attendance_changes({instance.event_id: 1 if created else 0}, joined=joined)
+
+
+def _from_event(origin):
+    # Deleting an event cascades to its attendees, the event's own
+    # post_delete already covers them.
+    return isinstance(origin, Event) or (isinstance(origin, QuerySet) and origin.model is Event)
+
+
+# One delete() (of a queryset, or cascading from a user) sends pre_delete for
+# every attendee row, deletes them all, then sends post_delete for each. The
+# co-attendance of a user's rows deleted together can only be uncounted once
+# all of them are gone, so the rows of one delete() are recorded together
+# after the last post_delete.
+_deleting = local()
+
+
+@receiver(pre_delete, sender=Attendee)
+def attendee_deleting(sender, instance, origin=None, **kwargs):
+    if _from_event(origin):
+        return
+    batch = getattr(_deleting, 'batch', None)
+    if batch is None or batch['origin'] is not origin:
+        # A delete() that failed half way leaves a stale batch behind
+        batch = _deleting.batch = {'origin': origin, 'pending': set(), 'deleted': []}
+    batch['pending'].add(instance.pk)
+
+
+@receiver(post_delete, sender=Attendee)
+def attendee_deleted(sender, instance, origin=None, **kwargs):
+    if _from_event(origin):
+        return
+    batch = _deleting.batch
+    batch['pending'].discard(instance.pk)
+    batch['deleted'].append((instance.user_id, instance.event_id))
+    if not batch['pending']:
+        _deleting.batch = None
+        record_leaves(batch['deleted'])
+    apply_attendance_changes({instance.event_id: -1}, left=[(instance.user_id, instance.event_id)])
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@receiver(connection_created)
+def instrument_queries(sender, connection, **kwargs):
+    install_query_counter(connection)
+    install_slow_query_capture(connection)
@@ -0,0 +1,106 @@
+"""
+Streaming JSON responses for lists that can grow without bound.
+
+Rows are read through a chunked server-side iterator and written out as
+they arrive, so worker memory stays flat and the first byte goes out before
+the whole list has been read.
+"""
+
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def wants_stream(request):
+    return request.GET.get('stream', '').lower() in TRUE_VALUES
+
+
+class _JsonList:
+    # Shared by the sync and async generators below.
+
+    def __init__(self, key, batch_size):
+        self.key = key
+        self.batch_size = batch_size or settings.API_STREAM_CHUNK_SIZE
+        self.encoder = DjangoJSONEncoder(separators=(',', ':'))
+        self.batch = []
+        self.first = True
+
+    def start(self):
+        return '{%s:[' % json.dumps(self.key)
+
+    def add(self, item):
+        self.batch.append(self.encoder.encode(item))
+        if len(self.batch) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self):
+        chunk = ('' if self.first else ',') + ','.join(self.batch)
+        self.batch = []
+        self.first = False
+        return chunk
+
+    def finish(self):
+        return (self.flush() if self.batch else '') + ']}'
+
+
+def iter_json_list(key, items, batch_size=None):
+    """
+    Yield ``{"<key>": [item, ...]}`` piece by piece.
+
+    Items are encoded with the same encoder ``JsonResponse`` uses and are
+    grouped ``batch_size`` to a chunk so the server isn't flushing a write
+    per row.
+    """
+    writer = _JsonList(key, batch_size)
+    yield writer.start()
+    for item in items:
+        chunk = writer.add(item)
+        if chunk is not None:
+            yield chunk
+    yield writer.finish()
+
+
+async def aiter_json_list(key, items, batch_size=None):
+    """
+    Async version of ``iter_json_list()`` for async iterables of items.
+    """
+    writer = _JsonList(key, batch_size)
+    yield writer.start()
+    async for item in items:
+        chunk = writer.add(item)
+        if chunk is not None:
+            yield chunk
+    yield writer.finish()
+
+
+async def aiter_rows(queryset, chunk_size=None):
+    """
+    Async chunked iteration over ``queryset``.
+
+    Stands in for ``QuerySet.aiterator()``, which on Django 4.2 runs
+    ``values_list()`` queries on the event loop's thread and fails.
+    """
+    chunk_size = chunk_size or settings.API_STREAM_CHUNK_SIZE
+    rows = await sync_to_async(lambda: iter(queryset.iterator(chunk_size=chunk_size)))()
+    next_chunk = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while True:
+        chunk = await next_chunk()
+        if not chunk:
+            return
+        for row in chunk:
+            yield row
+
+
+def stream_json_list(key, items):
+    if hasattr(items, '__aiter__'):
+        content = aiter_json_list(key, items)
+    else:
+        content = iter_json_list(key, items)
+    return StreamingHttpResponse(content, content_type='application/json')
@@ -1,18 +1,41 @@
+from importlib import import_module
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# The hot read and join/leave endpoints, async under SERVER_MODE=asgi. Only
+# imported when used so wsgi workers don't pay for them at boot.
+hot = import_module('api.async_views') if settings.API_ASYNC_VIEWS else views
+
 urlpatterns = [
 # Event Actions
     path('api/users/<int:user_id>/events/create', views.create_event, name='create_event'),
-    path('api/users/<int:user_id>/events/<int:event_id>/join', views.join_event, name='join_event'),
-    path('api/users/<int:user_id>/events/<int:event_id>/leave', views.leave_event, name='leave_event'),
-    path('api/users/<int:user_id>/events', views.get_user_events, name='user_events'),
-    path('api/users/<int:user_id>/events/<int:event_id>', views.get_one_event, name='one_event'),
+    path('api/users/<int:user_id>/events/bulk', views.bulk_create_events, name='bulk_create_events'),
+    path('api/users/<int:user_id>/events/<int:event_id>/join', hot.join_event, name='join_event'),
+    path('api/users/<int:user_id>/events/<int:event_id>/leave', hot.leave_event, name='leave_event'),
+    path('api/users/<int:user_id>/events/join', views.join_events, name='join_events'),
+    path('api/users/<int:user_id>/events/leave', views.leave_events, name='leave_events'),
+    path('api/users/<int:user_id>/events', hot.get_user_events, name='user_events'),
+    path('api/users/<int:user_id>/feed', views.get_user_feed, name='user_feed'),
+    path('api/users/<int:user_id>/recommendations', views.get_recommendations, name='recommendations'),
+    path('api/users/<int:user_id>/events/<int:event_id>', hot.get_one_event, name='one_event'),
     path('api/users/<int:user_id>/events/<int:event_id>/delete', views.delete_event, name='delete_event'),
-    path('api/events/<int:event_id>/attendees', views.event_attendees, name='users_attending_event'),
+    path('api/events/search', views.search_events, name='search_events'),
+    path('api/events/nearby', views.get_nearby_events, name='nearby_events'),
+    path('api/events/<int:event_id>/related', views.get_related_events, name='related_events'),
+    path('api/events/<int:event_id>/attendees', hot.event_attendees, name='users_attending_event'),
+    # Served by api.live.LiveEvents under asgi, in front of Django
+    path('api/events/<int:event_id>/live', views.live_event, name='live_event'),
+    path('api/events/<int:event_id>/attendees/join', views.join_users_to_event, name='join_users_to_event'),
+    path('api/events/<int:event_id>/attendees/leave', views.remove_users_from_event, name='remove_users_from_event'),
+    path('api/concerts/<int:concert_id>', views.get_concert, name='concert'),
+    path('api/concerts/<int:concert_id>/attendees', views.concert_attendees, name='concert_attendees'),
+    path('api/cache/stats', views.get_cache_stats, name='cache_stats'),
+    path('metrics', views.get_metrics, name='metrics'),
 # User Flow
     path('api/users/create', views.create_user, name='create_user'),
     path('api/users/login', views.login_user, name='login_user'),
     path('api/users/logout', views.logout_user, name='logout_user'),
     path('api/users/session', views.current_session, name='current_session'),
+    path('api/users/token/refresh', views.refresh_token, name='refresh_token'),
 ]
\ No newline at end of file
@@ -1,12 +1,83 @@
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
 import json
-from .models import Event, Attendee
+from django.conf import settings
+from .models import Concert, Event, Attendee
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST, require_GET
+from .attendance import (
+    ALREADY_ATTENDING, EVENT_NOT_FOUND, JOINED, LEFT, NOT_ATTENDING, USER_NOT_FOUND,
+    delete_event_attendees, join, join_many, leave, leave_many,
+)
+from .bulk import BulkImportError, import_events, parse_items, parse_options
+from .cache import cache_response, cache_stats, concert_scope, event_scope, user_events_scope
+from .coattendance import recommended_events, related_events
+from .conditional import conditional, event_attendees_validators, one_event_validators, user_events_validators
+from .geo import clean_coordinates, nearby_events
+from .metrics import render as render_metrics
+from .pagination import InvalidPage, get_limit, paginate, paginate_union
+from .search import parse_bound, query_terms, search_event_ids
+from .streaming import stream_json_list, wants_stream
+from .tokens import issue_token, revoke_token
+from .writebehind import FLUSH_FAILED, QUEUE_FULL, flush_pending, pending_changes, queue_join, queue_leave
+
+EVENT_ORDERING = ('date_time', 'id')
+ATTENDEE_ORDERING = ('user_id',)
+EVENT_ROW_FIELDS = (
+    'id', 'event_name', 'venue_name', 'date_time', 'artist',
+    'location', 'spotify_artist_id', 'ticketmaster_event_id', 'attendee_count', 'concert_id'
+)
+
+def event_data(event, username):
+    return {
+        'event_id': event.id,
+        'event_name': event.event_name,
+        'venue_name': event.venue_name,
+        'date_time': event.date_time,
+        'artist': event.artist,
+        'location': event.location,
+        'spotify_artist_id': event.spotify_artist_id,
+        'ticketmaster_event_id': event.ticketmaster_event_id,
+        'attendee_count': event.attendee_count,
+        'concert_id': event.concert_id,
+        'owner': username
+    }
+
+def event_row_data(row, username):
+    # row is a values_list() row of EVENT_ROW_FIELDS
+    return {
+        'event_id': row[0],
+        'event_name': row[1],
+        'venue_name': row[2],
+        'date_time': row[3],
+        'artist': row[4],
+        'location': row[5],
+        'spotify_artist_id': row[6],
+        'ticketmaster_event_id': row[7],
+        'attendee_count': row[8],
+        'concert_id': row[9],
+        'owner': username
+    }
+
+def _ranked_rows(ranked, key):
+    # ranked is a list of (event_id, value), the rows come back in its order
+    # with value under key, skipping events deleted in between
+    rows = {
+        row[0]: row for row in
+        Event.objects.filter(id__in=[event_id for event_id, _ in ranked])
+        .values_list(*EVENT_ROW_FIELDS, 'owner__username')
+    }
+    return [
+        dict(event_row_data(rows[event_id][:-1], rows[event_id][-1]), **{key: value})
+        for event_id, value in ranked if event_id in rows
+    ]
 
 @csrf_exempt
 def create_user(request):
@@ -53,6 +124,7 @@ def create_event(request, user_id):
         user = get_object_or_404(User, id=user_id)
         
         try:
+            latitude, longitude = clean_coordinates(data.get('latitude'), data.get('longitude'))
             event = Event.objects.create(
                 venue_name=data.get('venue_name'),
                 event_name=data.get('event_name'),
@@ -61,6 +133,8 @@ def create_event(request, user_id):
                 location=data.get('location'),
                 spotify_artist_id=data.get('spotify_artist_id'),
                 ticketmaster_event_id=data.get('ticketmaster_event_id'),
+                latitude=latitude,
+                longitude=longitude,
                 owner=user
             )
             
@@ -74,6 +148,7 @@ def create_event(request, user_id):
                     'location': event.location,
                     'spotify_artist_id': event.spotify_artist_id,
                     'ticketmaster_event_id': event.ticketmaster_event_id,
+                    'concert_id': event.concert_id,
                     'owner': user.username
                 }
             }, status=201)
@@ -82,107 +157,352 @@ def create_event(request, user_id):
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 @csrf_exempt
-def join_event(request, user_id, event_id):
+def bulk_create_events(request, user_id):
     if request.method == 'POST':
+        user = get_object_or_404(User, id=user_id)
+        
         try:
-            user = get_object_or_404(User, id=user_id)
-            event = get_object_or_404(Event, id=event_id)
-            
-            attendee, created = Attendee.objects.get_or_create(user=user, event=event)
-            
-            if created:
-                return JsonResponse({
-                    'data': {
-                        'user_id': user.id,
-                        'event_id': event.id,
-                        'username': user.username,
-                    }
-                }, status=201)
-            else:
-                return JsonResponse({'error': 'User is already attending this event'}, status=400)
+            options = parse_options(request)
+            items = parse_items(request)
+        except BulkImportError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        try:
+            results = import_events(user, items, **options)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
+        
+        summary = {status: 0 for status in ('created', 'skipped', 'invalid')}
+        for result in results:
+            summary[result['status']] += 1
+        
+        return JsonResponse({
+            'data': {
+                **summary,
+                'owner': user.username,
+                'results': results
+            }
+        }, status=201 if summary['created'] else 200)
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+ATTENDANCE_ERRORS = {
+    USER_NOT_FOUND: ('User not found', 404),
+    EVENT_NOT_FOUND: ('Event not found', 404),
+    ALREADY_ATTENDING: ('User is already attending this event', 400),
+    NOT_ATTENDING: ('User is not attending this event', 400),
+    QUEUE_FULL: ('Too many pending attendance changes, try again shortly', 503),
+    FLUSH_FAILED: ('Pending attendance changes could not be written, try again shortly', 503),
+}
+
+def attendance_error(outcome):
+    error, status = ATTENDANCE_ERRORS[outcome]
+    response = JsonResponse({'error': error}, status=status)
+    if status == 503:
+        response['Retry-After'] = '1'
+    return response
+
+@csrf_exempt
+def join_event(request, user_id, event_id):
+    if request.method == 'POST':
+        # With write-behind the join is acknowledged before it is written
+        queued = settings.API_WRITE_BEHIND
+        outcome, username = (queue_join if queued else join)(user_id, event_id)
+        
+        if outcome == JOINED:
+            return JsonResponse({
+                'data': {
+                    'user_id': user_id,
+                    'event_id': event_id,
+                    'username': username,
+                }
+            }, status=202 if queued else 201)
+        return attendance_error(outcome)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 @csrf_exempt
 def leave_event(request, user_id, event_id):
     if request.method == 'POST':
-        try:
-            user = get_object_or_404(User, id=user_id)
-            event = get_object_or_404(Event, id=event_id)
-            
-            try:
-                attendee = Attendee.objects.get(user=user, event=event)
-                attendee.delete()
-                return JsonResponse({'message': 'User has left the event'}, status=200)
-            except Attendee.DoesNotExist:
-                return JsonResponse({'error': 'User is not attending this event'}, status=400)
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=400)
+        queued = settings.API_WRITE_BEHIND
+        outcome = (queue_leave if queued else leave)(user_id, event_id)
+        
+        if outcome == LEFT:
+            return JsonResponse({'message': 'User has left the event'}, status=202 if queued else 200)
+        return attendance_error(outcome)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+def _batch_ids(request, key):
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        raise ValueError('Invalid JSON')
+    ids = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids or not all(type(i) is int for i in ids):
+        raise ValueError(f'{key} must be a non-empty list of integers')
+    if len(ids) > settings.BATCH_ATTENDANCE_MAX_IDS:
+        raise ValueError(f'Too many {key}, the limit is {settings.BATCH_ATTENDANCE_MAX_IDS}')
+    return ids
+
+def _batch_attendance(request, action, user_ids=None, event_ids=None):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        if user_ids is None:
+            user_ids = _batch_ids(request, 'user_ids')
+        else:
+            event_ids = _batch_ids(request, 'event_ids')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    # Outcomes are read from the database, which must have the joins and
+    # leaves this process acknowledged
+    if not flush_pending():
+        return attendance_error(FLUSH_FAILED)
+    try:
+        results = action(user_ids, event_ids)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    summary = {}
+    for _, _, outcome in results:
+        summary[outcome] = summary.get(outcome, 0) + 1
+    
+    return JsonResponse({
+        'data': {
+            'summary': summary,
+            'results': [{
+                'user_id': user_id,
+                'event_id': event_id,
+                'status': outcome
+            } for user_id, event_id, outcome in results]
+        }
+    }, status=200)
+
+@csrf_exempt
+def join_users_to_event(request, event_id):
+    return _batch_attendance(request, join_many, event_ids=[event_id])
+
+@csrf_exempt
+def remove_users_from_event(request, event_id):
+    return _batch_attendance(request, leave_many, event_ids=[event_id])
+
+@csrf_exempt
+def join_events(request, user_id):
+    return _batch_attendance(request, join_many, user_ids=[user_id])
+
+@csrf_exempt
+def leave_events(request, user_id):
+    return _batch_attendance(request, leave_many, user_ids=[user_id])
+
+@cache_response(event_scope)
+@conditional(event_attendees_validators)
 def event_attendees(request, event_id):
     if request.method == 'GET':
         try:
             event = get_object_or_404(Event, id=event_id)
-            attendees = Attendee.objects.filter(event=event)
+            if wants_stream(request):
+                rows = (
+                    Attendee.objects.filter(event=event)
+                    .order_by(*ATTENDEE_ORDERING)
+                    .values_list('user_id', 'user__username')
+                    .iterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+                )
+                return stream_json_list('attendees', ({
+                    'user_id': user_id,
+                    'username': username
+                } for user_id, username in rows))
+
+            try:
+                attendees, next_cursor = paginate(
+                    Attendee.objects.filter(event=event).values_list('user_id', 'user__username'),
+                    ATTENDEE_ORDERING,
+                    request.GET.get('cursor'),
+                    get_limit(request),
+                    key=lambda row: [row[0]]
+                )
+            except InvalidPage as e:
+                return JsonResponse({'error': str(e)}, status=400)
             
             attendees_list = [{
-                'user_id': attendee.user.id,
-                'username': attendee.user.username
-            } for attendee in attendees]
+                'user_id': user_id,
+                'username': username
+            } for user_id, username in attendees]
             
-            return JsonResponse({'attendees': attendees_list}, status=200)
+            return JsonResponse({'attendees': attendees_list, 'next': next_cursor}, status=200)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
     
+@cache_response(user_events_scope)
+@conditional(user_events_validators)
 def get_user_events(request, user_id):
     if request.method == 'GET':
         try:
             user = get_object_or_404(User, id=user_id)
-            events = Event.objects.filter(owner=user)
+            if wants_stream(request):
+                rows = (
+                    Event.objects.filter(owner=user)
+                    .order_by(*EVENT_ORDERING)
+                    .values_list(*EVENT_ROW_FIELDS)
+                    .iterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+                )
+                return stream_json_list('events', (event_row_data(row, user.username) for row in rows))
+
+            try:
+                events, next_cursor = paginate(
+                    Event.objects.filter(owner=user),
+                    EVENT_ORDERING,
+                    request.GET.get('cursor'),
+                    get_limit(request)
+                )
+            except InvalidPage as e:
+                return JsonResponse({'error': str(e)}, status=400)
             
-            events_list = [{
-                'event_id': event.id,
-                'event_name': event.event_name,
-                'venue_name': event.venue_name,
-                'date_time': event.date_time,
-                'artist': event.artist,
-                'location': event.location,
-                'spotify_artist_id': event.spotify_artist_id,
-                'ticketmaster_event_id': event.ticketmaster_event_id,
-                'owner': user.username
-            } for event in events]
+            events_list = [event_data(event, user.username) for event in events]
             
-            return JsonResponse({'events': events_list}, status=200)
+            return JsonResponse({'events': events_list, 'next': next_cursor}, status=200)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+@cache_response(event_scope)
+@conditional(one_event_validators)
 def get_one_event(request, user_id, event_id):
     if request.method == 'GET':
         try:
             user = get_object_or_404(User, id=user_id)
             event = get_object_or_404(Event, id=event_id, owner=user)
             
-            event_data = {
-                'event_id': event.id,
-                'event_name': event.event_name,
-                'venue_name': event.venue_name,
-                'date_time': event.date_time,
-                'artist': event.artist,
-                'location': event.location,
-                'spotify_artist_id': event.spotify_artist_id,
-                'ticketmaster_event_id': event.ticketmaster_event_id,
-                'owner': user.username
-            }
-            
-            return JsonResponse({'event': event_data}, status=200)
+            return JsonResponse({'event': event_data(event, user.username)}, status=200)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+@require_GET
+def search_events(request):
+    terms = query_terms(request.GET.get('q', ''))
+    if not terms:
+        return JsonResponse({'error': 'q must contain at least one word'}, status=400)
+    try:
+        limit = get_limit(request)
+        owner = request.GET.get('owner')
+        owner_id = int(owner) if owner is not None else None
+        start = parse_bound(request.GET['from']) if 'from' in request.GET else None
+        end = parse_bound(request.GET['to'], end=True) if 'to' in request.GET else None
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    ids = search_event_ids(terms, owner_id, start, end, limit)
+    rows = {
+        row[0]: row for row in
+        Event.objects.filter(id__in=ids).values_list(*EVENT_ROW_FIELDS, 'owner__username')
+    }
+    # In rank order, skipping events deleted in between
+    events_list = [event_row_data(rows[event_id][:-1], rows[event_id][-1]) for event_id in ids if event_id in rows]
+    return JsonResponse({'events': events_list}, status=200)
+
+@require_GET
+def get_nearby_events(request):
+    try:
+        latitude, longitude = clean_coordinates(request.GET.get('lat'), request.GET.get('lon'))
+        if latitude is None:
+            raise ValueError('lat and lon are required')
+        radius_km = float(request.GET.get('radius_km', settings.API_NEARBY_DEFAULT_RADIUS_KM))
+        if not 0 < radius_km <= settings.API_NEARBY_MAX_RADIUS_KM:
+            raise ValueError('radius_km must be greater than 0 and at most %s' % settings.API_NEARBY_MAX_RADIUS_KM)
+        start = parse_bound(request.GET['from']) if 'from' in request.GET else None
+        end = parse_bound(request.GET['to'], end=True) if 'to' in request.GET else None
+        limit = get_limit(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    nearest = nearby_events(latitude, longitude, radius_km, start, end, limit)
+    events_list = _ranked_rows([(event_id, round(distance, 3)) for event_id, distance in nearest], 'distance_km')
+    return JsonResponse({'events': events_list}, status=200)
+
+@require_GET
+def live_event(request, event_id):
+    # Only reached when the stream isn't served by api.live.LiveEvents: a
+    # sync worker would be held for as long as the client listens.
+    if not Event.objects.filter(id=event_id).exists():
+        return JsonResponse({'error': 'Event not found'}, status=404)
+    return JsonResponse({'error': 'Live updates are only served by ASGI workers (SERVER_MODE=asgi)'}, status=501)
+
+@require_GET
+def get_related_events(request, event_id):
+    if not Event.objects.filter(id=event_id).exists():
+        return JsonResponse({'error': 'Event not found'}, status=404)
+    try:
+        limit = get_limit(request)
+    except InvalidPage as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'events': _ranked_rows(related_events(event_id, limit), 'shared_attendees')}, status=200)
+
+@require_GET
+def get_recommendations(request, user_id):
+    if not User.objects.filter(id=user_id).exists():
+        return JsonResponse({'error': 'User not found'}, status=404)
+    try:
+        start = parse_bound(request.GET['from']) if 'from' in request.GET else timezone.now()
+        limit = get_limit(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'events': _ranked_rows(recommended_events(user_id, start, limit), 'score')}, status=200)
+
+@cache_response(concert_scope)
+@require_GET
+def get_concert(request, concert_id):
+    concert = (
+        Concert.objects.filter(id=concert_id)
+        .annotate(saved_count=Count('events'), attendee_count=Coalesce(Sum('events__attendee_count'), 0))
+        .first()
+    )
+    if concert is None:
+        return JsonResponse({'error': 'Concert not found'}, status=404)
+    return JsonResponse({'data': {
+        'concert_id': concert.id,
+        'ticketmaster_event_id': concert.ticketmaster_event_id,
+        'event_name': concert.event_name,
+        'venue_name': concert.venue_name,
+        'date_time': concert.date_time,
+        'artist': concert.artist,
+        'location': concert.location,
+        'spotify_artist_id': concert.spotify_artist_id,
+        # How many users saved the show, and how many attend any copy of it
+        'saved_count': concert.saved_count,
+        'attendee_count': concert.attendee_count,
+    }}, status=200)
+
+@cache_response(concert_scope)
+@require_GET
+def concert_attendees(request, concert_id):
+    if not Concert.objects.filter(id=concert_id).exists():
+        return JsonResponse({'error': 'Concert not found'}, status=404)
+    try:
+        # Everyone attending any user's copy of the show, once each
+        attendees, next_cursor = paginate(
+            Attendee.objects.filter(event__concert_id=concert_id).values_list('user_id', 'user__username').distinct(),
+            ATTENDEE_ORDERING,
+            request.GET.get('cursor'),
+            get_limit(request),
+            key=lambda row: [row[0]]
+        )
+    except InvalidPage as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    attendees_list = [{
+        'user_id': user_id,
+        'username': username
+    } for user_id, username in attendees]
+    return JsonResponse({'attendees': attendees_list, 'next': next_cursor}, status=200)
+
+@require_GET
+def get_cache_stats(request):
+    return JsonResponse({'data': cache_stats()}, status=200)
+
+@require_GET
+def get_metrics(request):
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @csrf_exempt
 @require_POST
 def login_user(request):
@@ -200,15 +520,17 @@ def login_user(request):
     user = authenticate(request, username=username, password=password)
     
     if user is not None:
-        login(request, user)
-        return JsonResponse({
-            'data': {
-                'user_id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'status': 'Logged in'
-            }
-        })
+        data = {
+            'user_id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'status': 'Logged in'
+        }
+        if settings.API_AUTH_MODE == 'token':
+            data.update(token=issue_token(user), expires_in=settings.API_TOKEN_MAX_AGE)
+        else:
+            login(request, user)
+        return JsonResponse({'data': data})
     else:
         return JsonResponse({'error': 'Invalid credentials'}, status=400)
 
@@ -217,7 +539,11 @@ def login_user(request):
 @login_required
 def logout_user(request):
     user = request.user
-    logout(request)
+    claims = getattr(request, 'token_claims', None)
+    if claims is not None:
+        revoke_token(claims)
+    else:
+        logout(request)
     return JsonResponse({
         'data': {
             'user_id': user.id,
@@ -227,6 +553,24 @@ def logout_user(request):
         }
     })
 
+@csrf_exempt
+@require_POST
+def refresh_token(request):
+    claims = getattr(request, 'token_claims', None)
+    if claims is None:
+        return JsonResponse({'error': 'A bearer token is required'}, status=401)
+    
+    revoke_token(claims)
+    user = request.user
+    return JsonResponse({
+        'data': {
+            'user_id': user.id,
+            'username': user.username,
+            'token': issue_token(user),
+            'expires_in': settings.API_TOKEN_MAX_AGE
+        }
+    })
+
 @csrf_exempt
 @require_GET
 def current_session(request):
@@ -244,6 +588,39 @@ def current_session(request):
             'status': 'Logged in'
         }
     })
+
+@require_GET
+def get_user_feed(request, user_id):
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    try:
+        start = parse_bound(request.GET['from']) if 'from' in request.GET else timezone.now()
+        # Joins and leaves of this user still queued by write-behind count
+        joined, left = pending_changes(user.id)
+        attending = Q(id__in=Attendee.objects.filter(user=user).values('event_id'))
+        if left:
+            attending &= ~Q(id__in=left)
+        if joined:
+            attending |= Q(id__in=joined)
+        # The owned and the joined events are paged separately and merged,
+        # see paginate_union()
+        events, next_cursor = paginate_union(
+            Event.objects.values_list(*EVENT_ROW_FIELDS, 'owner__username'),
+            [
+                Event.objects.filter(owner=user, date_time__gte=start),
+                Event.objects.filter(attending, date_time__gte=start),
+            ],
+            EVENT_ORDERING,
+            request.GET.get('cursor'),
+            get_limit(request),
+            key=lambda row: [row[3], row[0]]
+        )
+    except (InvalidPage, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    events_list = [dict(event_row_data(row[:-1], row[-1]), owned=row[-1] == user.username) for row in events]
+    return JsonResponse({'events': events_list, 'next': next_cursor}, status=200)
 # might need add @login_required to event create so only logged in users can create events 
 @csrf_exempt
 def delete_event(request, user_id, event_id):
@@ -251,7 +628,13 @@ def delete_event(request, user_id, event_id):
         try:
             user = get_object_or_404(User, id=user_id)
             event = get_object_or_404(Event, id=event_id, owner=user)
-            event.delete()
+            # A queued join of the event written while it's being deleted
+            # would fail its whole flush
+            if not flush_pending():
+                return attendance_error(FLUSH_FAILED)
+            with transaction.atomic():
+                delete_event_attendees(event.id)
+                event.delete()
             return JsonResponse({
                 'message': 'Event deleted successfully',
                 'data': {
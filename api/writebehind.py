@@ -0,0 +1,361 @@
+"""
+Write-behind for join_event and leave_event.
+
+With API_WRITE_BEHIND on, a join or leave is validated against the database
+and this process's unwritten changes, queued in memory and acknowledged
+with 202. A background thread writes what is queued every
+API_WRITE_BEHIND_FLUSH_MS milliseconds through attendance.write_pairs(): one
+transaction with one multi-row INSERT, a DELETE per event and one count
+UPDATE. When a show is announced and thousands of joins a second hit its
+event, the database's write lock is taken once per flush instead of once
+per join.
+
+Changes to the same pair coalesce: a leave cancels the queued join it
+follows, and the other way around. At most API_WRITE_BEHIND_MAX_PENDING
+pairs are queued; a request finding the queue full hurries the flusher, waits
+up to API_WRITE_BEHIND_MAX_WAIT_MS for room and otherwise gets 503.
+
+A user's unwritten changes show in what they read about themselves: the
+outcome of their next join or leave, and their feed. Everyone else sees
+them once written. The batch attendance endpoints and delete_event write
+this process's queue out before they read or delete attendee rows.
+
+The queue is written out when the process exits normally: atexit and
+gunicorn's worker_exit hook, or the lifespan shutdown of a uvicorn worker
+(see api/lifespan.py). A process that is killed loses what it acknowledged
+in its last flush interval.
+"""
+
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .attendance import (
+    ALREADY_ATTENDING, EVENT_NOT_FOUND, JOINED, LEFT, NOT_ATTENDING, USER_NOT_FOUND, lookup, write_pairs,
+)
+
+QUEUE_FULL = 'queue_full'
+FLUSH_FAILED = 'flush_failed'
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class WriteBehindQueue:
+    """
+    Unwritten attendance changes of one process, ``{user_id: {event_id:
+    JOINED or LEFT}}``. Changes being written stay visible until their
+    transaction commits.
+    """
+
+    def __init__(self, max_pending, flush_interval, max_wait):
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_wait = max_wait
+        # Bumped after every flush, which wrote the pairs in _written, see
+        # submit()
+        self.generation = 0
+        self._written = {}
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        # Set by the first change queued after a flush, and by a full queue
+        self._queued = threading.Event()
+        self._hurry = threading.Event()
+        self._pending = {}
+        self._size = 0
+        self._flushing = {}
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        return self._size
+
+    def _state(self, user_id, event_id):
+        state = self._pending.get(user_id, {}).get(event_id)
+        return state if state is not None else self._flushing.get(user_id, {}).get(event_id)
+
+    def pending_changes(self, user_id):
+        """
+        Return the ``(joined, left)`` event ids of ``user_id``'s unwritten
+        changes.
+        """
+        with self._lock:
+            states = dict(self._flushing.get(user_id, {}))
+            states.update(self._pending.get(user_id, {}))
+        joined = [event_id for event_id, state in states.items() if state == JOINED]
+        return joined, [event_id for event_id, state in states.items() if state == LEFT]
+
+    def submit(self, user_id, event_id, action, attending, generation, timeout=None):
+        """
+        Queue ``action`` (JOINED or LEFT) for the pair and return the
+        outcome, ``attending`` being whether the database had the attendee
+        row when ``generation`` was current. Return None when a flush has
+        written the pair since, so the caller looks again.
+
+        Raise QueueFull when there is no room after ``timeout`` seconds
+        (API_WRITE_BEHIND_MAX_WAIT_MS by default).
+        """
+        deadline = time.monotonic() + (self.max_wait if timeout is None else timeout)
+        with self._lock:
+            while self._size >= self.max_pending:
+                self._hurry.set()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QueueFull()
+                self._room.wait(remaining)
+            if generation != self.generation and (
+                generation + 1 != self.generation or event_id in self._written.get(user_id, {})
+            ):
+                return None
+
+            state = self._state(user_id, event_id)
+            if state is not None:
+                attending = state == JOINED
+            if action == JOINED and attending:
+                return ALREADY_ATTENDING
+            if action == LEFT and not attending:
+                return NOT_ATTENDING
+
+            events = self._pending.setdefault(user_id, {})
+            if event_id in events:
+                # The opposite change is queued, together they are none
+                del events[event_id]
+                if not events:
+                    del self._pending[user_id]
+                self._size -= 1
+            else:
+                events[event_id] = action
+                self._size += 1
+                if self._size == 1:
+                    self._queued.set()
+        return action
+
+    def _restore(self, batch):
+        # Put back a batch that failed to write, under the changes queued
+        # after it. Those are its opposites where they overlap.
+        for user_id, states in batch.items():
+            events = self._pending.setdefault(user_id, {})
+            for event_id, state in states.items():
+                if event_id in events:
+                    del events[event_id]
+                    self._size -= 1
+                else:
+                    events[event_id] = state
+                    self._size += 1
+            if not events:
+                del self._pending[user_id]
+        if self._size:
+            self._queued.set()
+
+    def flush(self):
+        """
+        Write every queued change in one transaction and return how many
+        pairs were written. A batch that fails is queued again.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._size:
+                    return 0
+                batch, size = self._pending, self._size
+                self._flushing, self._pending, self._size = batch, {}, 0
+                self._room.notify_all()
+
+            joins, leaves = [], []
+            for user_id, states in batch.items():
+                for event_id, state in states.items():
+                    (joins if state == JOINED else leaves).append((user_id, event_id))
+            try:
+                write_pairs(joins, leaves)
+            except Exception:
+                with self._lock:
+                    self._restore(batch)
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+                self._written = batch
+                self.generation += 1
+            return size
+
+    def _run(self):
+        try:
+            while True:
+                # Sleeps while nothing is queued, then gives the first change
+                # a flush interval to gather others
+                self._queued.wait()
+                self._hurry.wait(self.flush_interval)
+                self._queued.clear()
+                self._hurry.clear()
+                if self._stopping:
+                    return
+                # What request_started does for Django's own requests: a
+                # connection past CONN_MAX_AGE or broken by an error is
+                # replaced instead of held for the life of the process
+                close_old_connections()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('Writing queued attendance changes failed, retrying')
+                    time.sleep(self.flush_interval)
+        finally:
+            connection.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='api-write-behind', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the flusher and write what is still queued.
+        """
+        self._stopping = True
+        self._queued.set()
+        self._hurry.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        for attempt in range(3):
+            try:
+                self.flush()
+                return
+            except Exception:
+                if attempt == 2:
+                    raise
+
+
+def get_queue():
+    # One per process, started lazily: threads don't survive gunicorn's
+    # fork of a preloaded app.
+    global _queue
+    with _queue_lock:
+        if _queue is None or _queue[0] != os.getpid():
+            queue = WriteBehindQueue(
+                settings.API_WRITE_BEHIND_MAX_PENDING,
+                settings.API_WRITE_BEHIND_FLUSH_MS / 1000,
+                settings.API_WRITE_BEHIND_MAX_WAIT_MS / 1000,
+            )
+            queue.start()
+            atexit.register(drain)
+            _queue = (os.getpid(), queue)
+        return _queue[1]
+
+
+def drain():
+    """
+    Write out this process's queue, if it has one, and stop its flusher.
+    """
+    if _queue is not None and _queue[0] == os.getpid():
+        try:
+            _queue[1].stop()
+        except Exception:
+            logger.exception('Writing queued attendance changes on exit failed')
+
+
+def flush_pending():
+    """
+    Write this process's queued changes now, if it has any. Called before
+    writes that read or delete attendee rows without going through the
+    queue, so they see every change this process acknowledged.
+
+    Return False when the changes couldn't be written; they are queued
+    again for the flusher.
+    """
+    if _queue is not None and _queue[0] == os.getpid():
+        try:
+            _queue[1].flush()
+        except Exception:
+            logger.exception('Writing queued attendance changes failed')
+            return False
+    return True
+
+
+def pending_changes(user_id):
+    """
+    ``(joined, left)`` event ids of ``user_id``'s unwritten changes in this
+    process, empty when write-behind is off.
+    """
+    if _queue is None or _queue[0] != os.getpid():
+        return [], []
+    return _queue[1].pending_changes(user_id)
+
+
+def _checked(row):
+    if row is None:
+        return USER_NOT_FOUND
+    if not row[1]:
+        return EVENT_NOT_FOUND
+    return None
+
+
+def _queued(user_id, event_id, action):
+    queue = get_queue()
+    while True:
+        generation = queue.generation
+        row = lookup(user_id, event_id)
+        outcome = _checked(row)
+        if outcome is None:
+            try:
+                outcome = queue.submit(user_id, event_id, action, row[2], generation)
+            except QueueFull:
+                outcome = QUEUE_FULL
+        if outcome is not None:
+            return outcome, row and row[0]
+
+
+async def _aqueued(user_id, event_id, action):
+    # Never blocks the event loop: waits for room a flush interval at a time
+    queue = get_queue()
+    deadline = time.monotonic() + queue.max_wait
+    while True:
+        generation = queue.generation
+        row = await sync_to_async(lookup)(user_id, event_id)
+        outcome = _checked(row)
+        if outcome is None:
+            try:
+                outcome = queue.submit(user_id, event_id, action, row[2], generation, timeout=0)
+            except QueueFull:
+                if time.monotonic() >= deadline:
+                    outcome = QUEUE_FULL
+                else:
+                    await asyncio.sleep(queue.flush_interval)
+        if outcome is not None:
+            return outcome, row and row[0]
+
+
+def queue_join(user_id, event_id):
+    """
+    Queue ``user_id`` joining ``event_id`` and return ``(outcome,
+    username)`` like attendance.join(), or QUEUE_FULL.
+    """
+    outcome, username = _queued(user_id, event_id, JOINED)
+    return outcome, username if outcome == JOINED else None
+
+
+def queue_leave(user_id, event_id):
+    """
+    Queue ``user_id`` leaving ``event_id`` and return the outcome like
+    attendance.leave(), or QUEUE_FULL.
+    """
+    return _queued(user_id, event_id, LEFT)[0]
+
+
+async def aqueue_join(user_id, event_id):
+    outcome, username = await _aqueued(user_id, event_id, JOINED)
+    return outcome, username if outcome == JOINED else None
+
+
+async def aqueue_leave(user_id, event_id):
+    return (await _aqueued(user_id, event_id, LEFT))[0]
@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'concertmate_be.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Live event streams are served in front of Django (see api/live.py), and
+# worker startup and shutdown around both (see api/lifespan.py)
+from api.lifespan import Lifespan  # noqa: E402
+from api.live import LiveEvents  # noqa: E402
+
+application = Lifespan(LiveEvents(django_application))
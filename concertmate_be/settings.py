@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import database_config, sqlite_pragmas
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -47,15 +50,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
+    'api.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.TokenAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.common.CommonMiddleware'
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -101,17 +106,45 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'concertmate_be.wsgi.application'
 
+# 'wsgi' (sync gunicorn workers) or 'asgi' (uvicorn workers), see gunicorn.conf.py.
+# Under asgi the hot read and join/leave endpoints are served by api/async_views.py.
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+
+API_ASYNC_VIEWS = SERVER_MODE == 'asgi'
+
 
-# Database
+# Database, configured from the environment (see concertmate_be/database.py)
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 DATABASES = {
+    'default': database_config(BASE_DIR, SERVER_MODE),
+}
+
+# Run on every new SQLite connection (see concertmate_be/database.py)
+
+SQLITE_PRAGMAS = sqlite_pragmas()
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'concertmate',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Event read responses (see api/cache.py)
+
+API_CACHE_ALIAS = 'default'
+
+API_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -154,3 +187,109 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Keyset pagination for list endpoints (see api/pagination.py)
+
+API_PAGE_SIZE = 100
+
+API_MAX_PAGE_SIZE = 1000
+
+# Rows fetched per round trip (and written per chunk) by ?stream=1 responses
+
+API_STREAM_CHUNK_SIZE = 2000
+
+# Bulk event import (see api/bulk.py)
+
+BULK_IMPORT_BATCH_SIZE = 500
+
+BULK_IMPORT_MAX_ITEMS = 10000
+
+# Most ids accepted by the batch join/leave endpoints
+
+BATCH_ATTENDANCE_MAX_IDS = 500
+
+# 'session' (django.contrib.sessions) or 'token': login_user returns a signed
+# token that authenticates requests without any queries (see api/tokens.py)
+
+API_AUTH_MODE = os.environ.get('API_AUTH_MODE', 'session')
+
+# Seconds a token stays valid
+
+API_TOKEN_MAX_AGE = 900
+
+# Per-route request metrics served at /metrics (see api/metrics.py). Workers
+# that share a directory write their series there to be added up; empty keeps
+# them per process. gunicorn.conf.py sets it.
+
+API_METRICS_DIR = os.environ.get('API_METRICS_DIR', '')
+
+# Seconds between snapshots written to API_METRICS_DIR
+
+API_METRICS_FLUSH_INTERVAL = 5
+
+# Opt-in request profiling (see api/profiling.py). Requests sending an
+# X-Profile header from `manage.py profile_token`, and this share of all
+# requests, are profiled.
+
+API_PROFILE_SAMPLE_RATE = float(os.environ.get('API_PROFILE_SAMPLE_RATE', '0'))
+
+# Where captures go, and how many of the newest are kept
+
+API_PROFILE_DIR = os.environ.get('API_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+
+API_PROFILE_MAX_CAPTURES = 200
+
+# Seconds an X-Profile header stays valid
+
+API_PROFILE_TOKEN_MAX_AGE = 3600
+
+# Queries of a profiled request taking at least this long are explained
+
+API_SLOW_QUERY_MS = float(os.environ.get('API_SLOW_QUERY_MS', '100'))
+
+# Event search ranks at most this many of the newest matches (see
+# api/search.py), so a query matching most events stays fast
+
+API_SEARCH_CANDIDATES = 10000
+
+# Default and largest radius of api/events/nearby, in km
+
+API_NEARBY_DEFAULT_RADIUS_KM = 25
+
+API_NEARBY_MAX_RADIUS_KM = 500
+
+# Recommendations start from a user's latest API_RECOMMEND_SEED_EVENTS
+# attended events and score the API_RECOMMEND_CANDIDATES events sharing the
+# most attendees with each (see api/coattendance.py)
+
+API_RECOMMEND_SEED_EVENTS = 50
+
+API_RECOMMEND_CANDIDATES = 200
+
+# Write-behind for join_event and leave_event (see api/writebehind.py): they
+# answer 202 and a background thread writes the queued changes in batches
+# every API_WRITE_BEHIND_FLUSH_MS.
+
+API_WRITE_BEHIND = os.environ.get('API_WRITE_BEHIND', '0') != '0'
+
+API_WRITE_BEHIND_FLUSH_MS = 5
+
+# Most pairs queued per process, and how long a request waits for room
+# before it gets 503
+
+API_WRITE_BEHIND_MAX_PENDING = 10000
+
+API_WRITE_BEHIND_MAX_WAIT_MS = 100
+
+# Live attendance streams at api/events/<id>/live, served by ASGI workers
+# (see api/live.py). Workers sharing API_LIVE_DIR pass changes to each other
+# through it, gunicorn.conf.py sets it. Empty keeps them in the process.
+
+API_LIVE_DIR = os.environ.get('API_LIVE_DIR', '')
+
+# Seconds between keepalive comments on an idle stream
+
+API_LIVE_KEEPALIVE = 15
+
+# Messages buffered per stream for a slow client, older ones are dropped
+
+API_LIVE_BUFFER = 100
@@ -0,0 +1,48 @@
+"""
+Lean settings profile for the API workers.
+
+Use it with DJANGO_SETTINGS_MODULE=concertmate_be.settings_api. It is the
+full settings with the app registry and middleware chain cut down to what
+api/urls.py needs. The admin, messages, staticfiles and rest_framework apps
+aren't loaded. The CSRF, messages and clickjacking middleware don't run:
+every state-changing API view is csrf_exempt, and none of them renders HTML.
+
+Sessions are only loaded when API_AUTH_MODE is 'session'. In token mode,
+api.middleware.TokenAuthenticationMiddleware sets request.user on its own.
+
+Run management commands that need the admin or static files (collectstatic,
+createsuperuser through the admin) with the full settings.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import API_AUTH_MODE
+
+SESSION_APPS = [
+    'django.contrib.sessions',
+] if API_AUTH_MODE == 'session' else []
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    *SESSION_APPS,
+    'api',
+    'corsheaders',
+]
+
+SESSION_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+] if API_AUTH_MODE == 'session' else []
+
+MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    *SESSION_MIDDLEWARE,
+    'api.middleware.TokenAuthenticationMiddleware',
+]
+
+# No view renders a template
+TEMPLATES = []
@@ -0,0 +1,87 @@
+"""
+Gunicorn configuration, read automatically from the working directory.
+
+SERVER_MODE picks the deployment profile:
+
+- wsgi (default): sync workers running concertmate_be.wsgi, one request per
+  worker at a time.
+- asgi: uvicorn workers running concertmate_be.asgi, with the hot endpoints
+  served by async views so a request waiting on the database doesn't hold a
+  worker.
+
+Worker count and bind address come from gunicorn's own WEB_CONCURRENCY and
+PORT environment variables.
+"""
+
+import os
+import shutil
+import tempfile
+
+SERVER_MODES = {
+    'wsgi': ('concertmate_be.wsgi:application', 'sync'),
+    'asgi': ('concertmate_be.asgi:application', 'uvicorn_worker.UvicornWorker'),
+}
+
+server_mode = os.environ.get('SERVER_MODE', 'wsgi')
+if server_mode not in SERVER_MODES:
+    raise RuntimeError('SERVER_MODE must be one of: %s' % ', '.join(SERVER_MODES))
+
+wsgi_app, worker_class = SERVER_MODES[server_mode]
+
+# Import Django and the app once in the master and fork workers from it, so
+# booting or replacing a worker doesn't import anything. PRELOAD_APP=0 turns
+# it off, e.g. to pick up code changes on HUP.
+preload_app = os.environ.get('PRELOAD_APP', '1') != '0'
+
+# Workers write their request metrics here and /metrics adds them up (see
+# api/metrics.py). Set before the app loads so the settings pick it up.
+metrics_dir = os.environ.setdefault(
+    'API_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'concertmate-metrics-%s' % os.getpid())
+)
+
+# Workers with live event streams put their socket here, and every worker
+# sends attendance changes to all of them (see api/live.py)
+live_dir = os.environ.setdefault(
+    'API_LIVE_DIR', os.path.join(tempfile.gettempdir(), 'concertmate-live-%s' % os.getpid())
+)
+
+
+def on_starting(server):
+    # Don't add up snapshots left over from an earlier server
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    shutil.rmtree(live_dir, ignore_errors=True)
+
+
+def on_exit(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    shutil.rmtree(live_dir, ignore_errors=True)
+
+
+def worker_exit(server, worker):
+    # Not called in uvicorn workers, which do the same on lifespan shutdown
+    # (see api/lifespan.py).
+
+    # Write the joins and leaves the worker queued but hasn't written yet
+    # (see api/writebehind.py)
+    from api.writebehind import drain
+
+    drain()
+
+    # Keep the counts of a worker that is replaced (max_requests, timeouts,
+    # HUP) in the totals.
+    from api.metrics import write_snapshot
+
+    try:
+        write_snapshot()
+    except OSError:
+        pass
+
+
+def when_ready(server):
+    if preload_app:
+        # Runs in the master after the app is loaded: import the URLconf, and
+        # with it the views, before forking instead of on each worker's first
+        # request.
+        from django.urls import get_resolver
+
+        get_resolver().url_patterns